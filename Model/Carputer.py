@@ -1,32 +1,65 @@
-import sys
+import os
 import traceback
 import logging
 from OBDController import NoOBDDataException
+from DecodeFunctions import decode_obd_data
+from PIDScheduler import PIDScheduler
+from RingBuffer import RingBuffer
+from Sample import Sample
+from Pipeline import Stage
+from DisplayService import DisplayService
+from DriveLog import DriveLogWriter
+from Clock import GPSClock
 from threading import Thread, Event
 from Queue import Queue
-from time import sleep, time, mktime, strptime
+from time import sleep
 
 
 class Carputer(object):
 
-    def __init__(self, obdcontroller, gpscontroller, oledcontroller, drivedatabase):
+    def __init__(self, obdcontroller, gpscontroller, oledcontroller, drivedatabase,
+                 storage_queue_size=512, storage_policy=Stage.BLOCK, display_fps=5.0, log_dir='/home/pi',
+                 record=False):
+        """
+        Samples are collected on the loop thread as fast as the OBD link answers, and handed off to a storage stage
+        and the display service, each on its own thread, so a slow SD card write or I2C transfer never holds up the
+        next sample. The storage queue is deep enough to ride out a slow commit without dropping rows; the display
+        only ever draws the latest state, at most display_fps times a second. Each drive's debug log goes in log_dir,
+        and with record, a DriveLog of its raw OBD responses and GPS fixes too.
+        """
         # trip variables, used for calculating trip stats
         self.running = False
         self.loop_thread = None
         self.total_gal = 0.0
         self.total_distance = 0.0
+        self.trip_time = 0.0
+        self.last_sample_time = None
+        # Last few minutes of samples, for rolling figures that don't need a trip back to the db; logged every minute
+        self.recent = RingBuffer()
 
         self.obd = obdcontroller
+        # Speed and MAF go out with every request; slower-changing PIDs share whatever room is left
+        self.scheduler = PIDScheduler(obdcontroller)
         self.gps = gpscontroller
+        self.clock = GPSClock(gpscontroller)
         self.screen = oledcontroller
         self.db = drivedatabase
+        self.log_dir = log_dir
+        self.record = record
+        self.recorder = None
+
+        self.storage = Stage('storage', self.store, storage_queue_size, storage_policy)
+        # Once setup's loading animation is done, nothing but the display service touches the screen
+        self.display = DisplayService(oledcontroller, display_fps)
 
     @staticmethod
     def get_track(degrees):
         """
-        Converts degree measurement to cardinal track
+        Converts degree measurement to cardinal track, or '--' when there isn't one (NaN without a fix)
         This is probably not especially accurate, but that's fine for now.
         """
+        if degrees is None or degrees != degrees:
+            return '--'
 
         tracks = {xrange(39): 'N', xrange(39, 84): 'NE', xrange(84, 129): 'E',
                   xrange(129, 174): 'SE', xrange(174, 219): 'S', xrange(219, 264): 'SW',
@@ -38,87 +71,73 @@ class Carputer(object):
 
     def gen_timestamp(self):
         """
-        Converts date string from gps to epoch time and returns that as an int.
+        Returns the current UTC time in milliseconds, from the monotonic clock pinned to GPS time
         """
-        pattern = '%Y-%m-%dT%H:%M:%S'
-        timestamp = int(mktime(strptime(self.gps.time, pattern)))
-        return timestamp
+        return self.clock.now()
 
-    @staticmethod
-    def create_message(values):
-        """
-        Takes data values in format trip average, MinPG, track and creates a
-        properly-spaced string of averages to print to LCD
+    # Data capture
 
-        Returns lcd-ready message that is broken in half by a newline.
+    def poll_obd(self, pending):
         """
-        trip_avg, minutes_per_gallon, track = values
-
-        # Center messages on 16x2 LCD
-        top_pad = (7 - len(minutes_per_gallon.split('.')[0])) * ' '
-        top_message = top_pad + str(minutes_per_gallon)
-        bottom_pad = (6 - len(track)) * ' '
-        bottom_message = bottom_pad + track + ' | ' + str(trip_avg)
-
-        # create single message
-        message = top_message + '\n' + bottom_message
-        return message
-
-    # Data capture
+        Waits for the scheduled request in pending to be answered, returns instantaneous MPG and speed
+        """
+        return self.compute_mpg(pending.result(self.obd.response_timeout))
 
-    def poll_obd(self):
+    @staticmethod
+    def compute_mpg(response):
         """
-        Gets current speed and mass air flow, returns instantaneous MPG and speed
+        Returns instantaneous MPG and speed from a response holding speed and MAF
         """
-        speed = self.obd.speed
-        maf = self.obd.maf
+        speed = decode_obd_data('010D', response['010D'])
+        maf = decode_obd_data('0110', response['0110'])
 
         # My calculation gives a constant of 7.100295,
         # but the accepted value seems to be 7.107
         mpg = 7.107 * speed / maf
-        return {'MPG': str(mpg), 'SPD': str(speed)}
+        return mpg, speed
 
-    def poll_gps(self):
+    @staticmethod
+    def poll_gps(fix):
         """
-        Gets current latitude, longitude, and course
+        Gets latitude, longitude, and course from a gps fix
         """
-        return {'LAT': str(self.gps.fix.latitude), 'LON': str(self.gps.fix.longitude),
-                'TRA': str(self.gps.fix.track)}
+        return fix.latitude, fix.longitude, fix.track
 
-    def get_data(self):
+    def get_data(self, pending):
         """
-        Gets speed and MAF from OBD; lat, long, track and timestamp from GPS; length of OBD 'tick' from systime and
-        returns them as a dict of strings. Strings are returned to make joining into a db commit easier.
+        Gets speed and MAF from the pending OBD request; lat, long, track and timestamp from GPS; length of OBD 'tick'
+        from the monotonic clock and returns them as a Sample.
         """
-        timestamp = str(self.gen_timestamp())
-        gps_data = self.poll_gps()
-        # Sys time is more granular than GPS module time, so use it since we care about the interval, not actual time
+        timestamp = self.gen_timestamp()
+        lat, lon, track = self.poll_gps(self.gps.fix)
+        mpg, speed = self.poll_obd(pending)
+        # The monotonic clock is more granular than GPS module time and never steps, and we care about the interval
         # GPS can do better, I just haven't implemented it
-        start = time()
-        obd_data = self.poll_obd()
-        tick_length = str(time() - start)
+        # The tick runs from the previous sample's answer to this one's, the first one from when it was sent
+        start = self.last_sample_time if self.last_sample_time is not None else pending.sent_at
+        self.last_sample_time = pending.completed_at
+        tick_length = self.last_sample_time - start
 
         """
         TODO: get speed from GPS instead of OBD?
         Advantages: probably more accurate, definitely faster, reduces load on OBD (which is the main bottleneck)
         Disadvantages: Can't continue tracking MPG data when satellite fix lost
         """
-        return ({'TIMESTAMP': timestamp, 'MPG': obd_data['MPG'], 'SPD': obd_data['SPD'],
-                 'LAT': gps_data['LAT'], 'LON': gps_data['LON'], 'TRA': gps_data['TRA'], 'TICK': tick_length})
+        return Sample(timestamp, mpg, speed, lat, lon, track, tick_length)
 
-    def process_data(self, data):
+    def process_data(self, sample):
         """
         Processes data received from gps and obd instruments into current trip mpg average,
         minutes of driving at current speed to consume one gallon of fuel, and current cardinal track (based on gps val).
 
-        Returns processed values as strings in format trip average, MinPG, track
+        Returns processed values in format trip average, MinPG, track. Also fills in the sample's distance and fuel.
         """
         # Fuel consumed in one second is (vss/3600)/mpg, so fuel/tick is that times the length of the tick
         # So then total mpg is (total distance)/(total gallons)
-        speed = float(data['SPD'])
-        mpg = float(data['MPG'])
-        tick_length = float(data['TICK'])
-        degrees = float(data['TRA'])
+        speed = sample.speed
+        mpg = sample.mpg
+        tick_length = sample.tick
+        degrees = sample.track
 
         tick_distance = (speed/3600.0) * tick_length
         # Consumtion could also be mpg/mph/3600
@@ -126,13 +145,20 @@ class Carputer(object):
 
         self.total_gal += tick_consumption
         self.total_distance += tick_distance
+        sample.distance = tick_distance
+        sample.fuel = tick_consumption
+        self.trip_time += tick_length
+        self.recent.add(self.trip_time, mpg, speed, tick_distance, tick_consumption)
+        if int(self.trip_time / 60) != int((self.trip_time - tick_length) / 60):
+            logging.debug('Last minute: %s\nlast 5 minutes: %s', self.recent.window(60), self.recent.window(300))
 
         try:
             trip_avg = round(self.total_distance/self.total_gal, 2)
         except ZeroDivisionError:
             trip_avg = 0.0
-        logging.debug('tick length: {0}\ntick distance: {1}\nconsumption: {2}'
-                      '\ntrip avg: {3}'.format(tick_length, tick_distance, tick_consumption, trip_avg))
+        # Arguments rather than str.format, so nothing is formatted unless debug logging is on
+        logging.debug('tick length: %s\ntick distance: %s\nconsumption: %s\ntrip avg: %s',
+                      tick_length, tick_distance, tick_consumption, trip_avg)
 
         try:
             minutes_per_gallon = round(tick_length/(tick_consumption * 60.0), 2)
@@ -143,10 +169,17 @@ class Carputer(object):
         # get track as cardinal direction
         track = self.get_track(degrees)
 
-        return str(trip_avg), str(minutes_per_gallon), track
+        return trip_avg, minutes_per_gallon, track
+
+    def store(self, sample):
+        """
+        Storage stage: writes a sample to the db and checkpoints it while the car is stopped
+        """
+        self.db.write_values(sample)
+        self.db.maybe_checkpoint(stopped=sample.speed == 0)
 
     def setup(self):
-        """Initializes GPS and OBD devices, waits for satellite fix, then creates DB table for drive"""
+        """Initializes GPS and OBD devices, waits for satellite fix, then adds the drive to the DB"""
 
         # Loading animation is run on another thread so setup can occur while maintaining seamless animation
         message_queue = Queue(1)
@@ -160,52 +193,64 @@ class Carputer(object):
         self.obd.connect()
         # Wait for GPS to get fix, as we'll use the GPS's time for timestamps
         message_queue.put('Waiting For Fix')
-        while not self.gps.has_fix:
-            sleep(.25)
+        self.gps.wait_for_fix()
         message_queue.put('Initializing DB')
-        self.db.new_table(self.gen_timestamp())
+        self.db.new_drive(self.gen_timestamp())
         complete_token.set()
         t.join()
 
     def start(self):
         self.setup()
-        # TODO: logging may not cover methods running on other threads, e.g. runloop
-        logging.basicConfig(stream=sys.stderr, level=logging.DEBUG,
-                            filename="/home/pi/" + self.db.current_table + ".log")
+        # Add the handler ourselves: basicConfig does nothing if anything has logged to the root logger already
+        root = logging.getLogger()
+        root.addHandler(logging.FileHandler(os.path.join(self.log_dir, "drive{0}.log".format(self.db.current_drive))))
+        root.setLevel(logging.DEBUG)
+        logging.debug('OBD tuning: settings {0}, {1} s per request'.format(self.obd.settings, self.obd.latency))
+        device = self.screen.device
+        logging.debug('OLED I2C bus clock: {0} Hz, {1} writes'.format(
+            device.bus_clock, 'SMBus block' if device.raw is None else 'raw'))
+        if self.record:
+            self.recorder = DriveLogWriter(os.path.join(self.log_dir, "drive{0}.drv".format(self.db.current_drive)))
+            self.obd.recorder = self.recorder
+            self.gps.recorder = self.recorder
         self.loop_thread = Thread(target=self.run_loop)
 
+        self.storage.start()
+        self.display.start()
         self.running = True
         # Is the change to False not seen by thread?
         self.loop_thread.start()
 
     def run_loop(self):
+        pending = None
         while self.running:
 
             # TODO: Continue to collect data even when GPS loses satellite fix
             if not self.gps.has_fix:
-                self.screen.clear()
-                sleep(.5)
-                self.screen.print_message('Lost Satellite Fix')
-                sleep(.5)
+                self.display.publish('Lost Satellite Fix')
+                sleep(1)
 
             # get data, write to DB
             try:
-                data = self.get_data()
-                self.db.write_values(data)
-                message = self.create_message(self.process_data(data))
-                self.screen.clear()
-                self.screen.print_message(message)
+                if pending is None:
+                    pending = self.scheduler.request()
+                sample = self.get_data(pending)
+                # Ask for the next sample straight away so the bus answers while we process this one
+                pending = self.scheduler.request()
+                trip = self.process_data(sample)
+                self.storage.put(sample)
+                self.display.publish(trip)
 
             except NoOBDDataException as e:
                 # Raised in poll_obd when a bad message is received from OBD device (after car shuts off)
+                pending = None
                 logging.debug("Bad OBD message received, terminating")
                 logging.debug("Command: {0}\nResponse: {1}".format(e.command, e.response))
-                self.screen.clear()
-                self.screen.print_message("No OBD Data Received")
+                self.display.publish("No OBD Data Received")
 
             except Exception as e:
-                self.screen.clear()
-                self.screen.print_message(str(e.message)[:16] + '\n' + str(e.message)[16:])
+                pending = None
+                self.display.publish(str(e.message))
                 logging.debug(e.message)
                 logging.debug(traceback.format_exc())
                 logging.debug("----------------------\n\n")
@@ -217,13 +262,24 @@ class Carputer(object):
         self.running = False
         # Wait for the loop to terminate
         self.loop_thread.join(timeout=5)
+        # Storage works through every queued sample before stopping
+        self.storage.stop()
+        logging.debug('Frames drawn: {0}, coalesced: {1}, dropped samples: {2}'.format(
+            self.display.frames, self.display.coalesced, self.storage.dropped))
         if self.loop_thread.is_alive():
-            self.screen.clear()
-            self.screen.print_message("Abnormal termination")
-        for method in self.obd.disconnect, self.gps.stop, self.screen.clear:
+            self.display.publish("Abnormal termination")
+        logging.debug('Achieved PID rates: {0}'.format(self.scheduler.achieved_rates()))
+        logging.debug('Trouble codes: {0}'.format(self.scheduler.latest.get(PIDScheduler.TROUBLE_CODES)))
+        # Closing the db flushes whatever rows are still buffered
+        for method in self.db.close, self.obd.disconnect, self.gps.stop:
             try:
                 method()
             except Exception as e:
                 logging.debug(e.message)
-        self.screen.print_message("Powering off.")
+        if self.recorder is not None:
+            self.recorder.close()
+            logging.debug('Recorded {0} records to {1}'.format(self.recorder.records, self.recorder.path))
+        # The display draws this last message before its thread finishes
+        self.display.publish("Powering off.")
+        self.display.stop()
 
@@ -0,0 +1,120 @@
+import calendar
+import ctypes
+import ctypes.util
+import os
+from time import strptime, strftime, gmtime, time
+from GPSSource import MODE_2D
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no time.monotonic, so ask the kernel for CLOCK_MONOTONIC ourselves. Wall time won't do: a Pi
+    # without an RTC often has its clock stepped by NTP or gpsd right around the first fix.
+    CLOCK_MONOTONIC = 1
+
+    class _timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    _clock_gettime = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        """
+        Seconds since some fixed point in the past, unaffected by changes to the system clock
+        """
+        t = _timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class GPSClock(object):
+    """
+    Serves UTC timestamps in milliseconds without parsing a date per sample. The GPS's UTC time is parsed once and
+    pinned to the monotonic clock; after that a timestamp is just monotonic() plus that offset. Every check_interval
+    seconds the latest fix is compared against the clock, and if they disagree by more than max_drift seconds the
+    clock is pinned again. Timestamps never go backwards, even when that moves the clock back: each is at least a
+    millisecond after the last, so no two samples share a row key.
+    """
+
+    PATTERN = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, gps, max_drift=1.0, check_interval=60.0):
+        self.gps = gps
+        self.max_drift = max_drift
+        self.check_interval = check_interval
+        self.resyncs = 0
+        # UTC seconds minus monotonic seconds
+        self._offset = None
+        # When the offset last came from the GPS, None while it comes from the system clock
+        self._last_check = None
+        self._last = None
+
+    @classmethod
+    def parse_utc(cls, utc):
+        """
+        Converts a GPS UTC string like '2016-01-03T22:51:50.25Z' to epoch seconds. Uses timegm, so the Pi's local
+        time zone doesn't matter.
+        """
+        whole, _, fraction = utc.rstrip('Z').partition('.')
+        seconds = calendar.timegm(strptime(whole, cls.PATTERN))
+        return seconds + float('0.' + fraction) if fraction else float(seconds)
+
+    @classmethod
+    def format_utc(cls, seconds):
+        """
+        The reverse of parse_utc, to the millisecond
+        """
+        whole, milliseconds = divmod(int(round(seconds * 1000)), 1000)
+        return '{0}.{1:03d}Z'.format(strftime(cls.PATTERN, gmtime(whole)), milliseconds)
+
+    @staticmethod
+    def has_time(fix):
+        """
+        Whether fix carries a UTC time worth setting the clock by; gpsd reports without a fix often have none
+        """
+        return fix is not None and fix.mode >= MODE_2D and bool(fix.utc)
+
+    def sync(self, fix=None):
+        """
+        Pins the clock to fix (the GPS's latest if not given), taking its time as the UTC time it was received. Without
+        a time to pin to, the clock goes by the system clock until the GPS has one.
+        """
+        if fix is None:
+            fix = self.gps.fix
+        if self.has_time(fix):
+            if self._last_check is None:
+                # Don't hold GPS time back to whatever the system clock said before it
+                self._last = None
+            self._offset = self.parse_utc(fix.utc) - fix.received
+            self._last_check = monotonic()
+            self.resyncs += 1
+        elif self._offset is None:
+            self._offset = time() - monotonic()
+
+    def drift(self, fix=None):
+        """
+        Seconds the GPS's time is ahead of ours for fix (the GPS's latest if not given)
+        """
+        if fix is None:
+            fix = self.gps.fix
+        return self.parse_utc(fix.utc) - (fix.received + self._offset)
+
+    def now(self):
+        """
+        Current UTC time as integer milliseconds since the epoch
+        """
+        current = monotonic()
+        if self._offset is None or self._last_check is None:
+            self.sync()
+        elif current - self._last_check >= self.check_interval:
+            self._last_check = current
+            fix = self.gps.fix
+            if self.has_time(fix) and abs(self.drift(fix)) > self.max_drift:
+                self.sync(fix)
+        timestamp = int((current + self._offset) * 1000)
+        if self._last is not None and timestamp <= self._last:
+            timestamp = self._last + 1
+        self._last = timestamp
+        return timestamp
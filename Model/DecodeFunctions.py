@@ -1,20 +1,135 @@
 __author__ = 'benradosevich'
 
+from collections import namedtuple
 
-def decode_obd_data(command, response_list):
-    return {
-        '010D': speed,
-        '0110': maf
-    }[command](response_list)
+# One entry per mode 01 PID. formula takes the PID's data bytes (A, B, C, D in the usual OBD-II notation) as an
+# indexable sequence and returns the decoded value, so it runs unchanged on a bytearray or on columns of a NumPy matrix.
+PIDDecoder = namedtuple('PIDDecoder', 'pid name length units formula')
 
 
-def speed(response_list):
-    a = int(response_list[0], 16)
-    return float(a)
+def _word(d):
+    return d[0] * 256 + d[1]
 
 
-def maf(response_list):
-    a = int(response_list[0], 16)
-    b = int(response_list[1], 16)
-    return ((a * 256) + b)/100.0
+def _percent(d):
+    return d[0] * 100 / 255.0
 
+
+def _temperature(d):
+    return d[0] - 40
+
+
+def _fuel_trim(d):
+    return d[0] * 100 / 128.0 - 100
+
+
+def _o2_voltage(d):
+    return d[0] / 200.0
+
+
+def _bitmask(d):
+    return ((d[0] * 256 + d[1]) * 256 + d[2]) * 256 + d[3]
+
+
+# Built once at import so decoding never has to build anything per call
+DECODERS = dict((decoder.pid, decoder) for decoder in [
+    PIDDecoder('0100', 'PIDS_A', 4, 'bitmask', _bitmask),
+    PIDDecoder('0101', 'STATUS', 4, 'bitmask', _bitmask),
+    PIDDecoder('0103', 'FUEL_STATUS', 2, 'bitmask', _word),
+    PIDDecoder('0104', 'LOAD', 1, '%', _percent),
+    PIDDecoder('0105', 'COOLANT_TEMP', 1, 'C', _temperature),
+    PIDDecoder('0106', 'SHORT_FUEL_TRIM_1', 1, '%', _fuel_trim),
+    PIDDecoder('0107', 'LONG_FUEL_TRIM_1', 1, '%', _fuel_trim),
+    PIDDecoder('0108', 'SHORT_FUEL_TRIM_2', 1, '%', _fuel_trim),
+    PIDDecoder('0109', 'LONG_FUEL_TRIM_2', 1, '%', _fuel_trim),
+    PIDDecoder('010A', 'FUEL_PRESSURE', 1, 'kPa', lambda d: d[0] * 3),
+    PIDDecoder('010B', 'INTAKE_PRESSURE', 1, 'kPa', lambda d: d[0]),
+    PIDDecoder('010C', 'RPM', 2, 'rpm', lambda d: _word(d) / 4.0),
+    PIDDecoder('010D', 'SPEED', 1, 'km/h', lambda d: d[0] * 1.0),
+    PIDDecoder('010E', 'TIMING_ADVANCE', 1, 'deg', lambda d: d[0] / 2.0 - 64),
+    PIDDecoder('010F', 'INTAKE_TEMP', 1, 'C', _temperature),
+    PIDDecoder('0110', 'MAF', 2, 'g/s', lambda d: _word(d) / 100.0),
+    PIDDecoder('0111', 'THROTTLE_POS', 1, '%', _percent),
+    PIDDecoder('0113', 'O2_SENSORS', 1, 'bitmask', lambda d: d[0]),
+    PIDDecoder('0114', 'O2_B1S1', 2, 'V', _o2_voltage),
+    PIDDecoder('0115', 'O2_B1S2', 2, 'V', _o2_voltage),
+    PIDDecoder('0116', 'O2_B1S3', 2, 'V', _o2_voltage),
+    PIDDecoder('0117', 'O2_B1S4', 2, 'V', _o2_voltage),
+    PIDDecoder('0118', 'O2_B2S1', 2, 'V', _o2_voltage),
+    PIDDecoder('0119', 'O2_B2S2', 2, 'V', _o2_voltage),
+    PIDDecoder('011A', 'O2_B2S3', 2, 'V', _o2_voltage),
+    PIDDecoder('011B', 'O2_B2S4', 2, 'V', _o2_voltage),
+    PIDDecoder('011C', 'OBD_COMPLIANCE', 1, 'enum', lambda d: d[0]),
+    PIDDecoder('011F', 'RUN_TIME', 2, 's', _word),
+    PIDDecoder('0120', 'PIDS_B', 4, 'bitmask', _bitmask),
+    PIDDecoder('0121', 'DISTANCE_W_MIL', 2, 'km', _word),
+    PIDDecoder('0123', 'FUEL_RAIL_PRESSURE_DIRECT', 2, 'kPa', lambda d: _word(d) * 10),
+    PIDDecoder('012C', 'COMMANDED_EGR', 1, '%', _percent),
+    PIDDecoder('012E', 'COMMANDED_EVAP_PURGE', 1, '%', _percent),
+    PIDDecoder('012F', 'FUEL_LEVEL', 1, '%', _percent),
+    PIDDecoder('0130', 'WARMUPS_SINCE_DTC_CLEAR', 1, 'count', lambda d: d[0]),
+    PIDDecoder('0131', 'DISTANCE_SINCE_DTC_CLEAR', 2, 'km', _word),
+    PIDDecoder('0133', 'BAROMETRIC_PRESSURE', 1, 'kPa', lambda d: d[0]),
+    PIDDecoder('0140', 'PIDS_C', 4, 'bitmask', _bitmask),
+    PIDDecoder('0142', 'CONTROL_MODULE_VOLTAGE', 2, 'V', lambda d: _word(d) / 1000.0),
+    PIDDecoder('0143', 'ABSOLUTE_LOAD', 2, '%', lambda d: _word(d) * 100 / 255.0),
+    PIDDecoder('0145', 'RELATIVE_THROTTLE_POS', 1, '%', _percent),
+    PIDDecoder('0146', 'AMBIENT_AIR_TEMP', 1, 'C', _temperature),
+    PIDDecoder('0147', 'THROTTLE_POS_B', 1, '%', _percent),
+    PIDDecoder('0149', 'ACCELERATOR_POS_D', 1, '%', _percent),
+    PIDDecoder('014A', 'ACCELERATOR_POS_E', 1, '%', _percent),
+    PIDDecoder('014C', 'THROTTLE_ACTUATOR', 1, '%', _percent),
+    PIDDecoder('0152', 'ETHANOL_PERCENT', 1, '%', _percent),
+    PIDDecoder('015C', 'OIL_TEMP', 1, 'C', _temperature),
+    PIDDecoder('015E', 'FUEL_RATE', 2, 'L/h', lambda d: _word(d) / 20.0),
+])
+
+# Number of data bytes the ECU returns for each PID, needed to split multi-PID responses
+PID_LENGTHS = dict((pid, decoder.length) for pid, decoder in DECODERS.items())
+
+
+def decode_obd_data(command, data):
+    """
+    Decodes the data bytes of a single PID's response.
+    data is a bytearray (or any sequence of ints), e.g. decode_obd_data('0110', bytearray([0x01, 0x7B])) returns 3.79
+    """
+    return DECODERS[command].formula(data)
+
+
+def units(command):
+    return DECODERS[command].units
+
+
+def decode_frames(frames, pids):
+    """
+    Decodes a whole drive's worth of captured frames at once, e.g. on a desktop after copying raw frames off the Pi.
+    frames is an (n, 4) uint8 NumPy matrix holding each frame's data bytes A-D, zero-padded for shorter PIDs, and pids
+    is a length-n column of PID codes, as strings like '010D', as the PID byte itself (0x0D) or a mix of both.
+    Every formula runs once per PID over all of that PID's rows, so there is no Python-level loop per frame.
+    Returns a dict of PID: (row indices, float64 array of decoded values)
+    """
+    # NumPy is only needed for bulk decoding, which doesn't happen on the Pi
+    import numpy as np
+
+    frames = np.asarray(frames, dtype=np.uint8)
+    pids = np.asarray(pids)
+    if pids.dtype.kind == 'S':
+        pids = pids.astype(str)
+    codes, inverse = np.unique(pids, return_inverse=True)
+
+    # Which of the unique codes stand for each PID
+    groups = {}
+    for i, code in enumerate(codes):
+        # NumPy turns the ints in a mixed column into decimal strings, which are never four characters like a PID is
+        code = str(code)
+        groups.setdefault(code if len(code) == 4 else '01{0:02X}'.format(int(code)), []).append(i)
+
+    columns = {}
+    for pid, indices in groups.items():
+        decoder = DECODERS[pid]
+        rows = np.flatnonzero(np.isin(inverse, indices))
+        # Widen before decoding so formulas like A - 40 can't wrap around in uint8
+        data = frames[rows, :decoder.length].T.astype(np.float64)
+        columns[pid] = (rows, np.asarray(decoder.formula(data), dtype=np.float64))
+
+    return columns
@@ -0,0 +1,73 @@
+import logging
+import traceback
+from threading import Thread, Condition
+from time import sleep
+from Clock import monotonic
+
+
+class DisplayService(object):
+    """
+    Owns the screen on a thread of its own. Callers publish() what the screen should show, either a message string or
+    the (trip average, minutes per gallon, track) values from Carputer.process_data, and carry on; the thread draws the
+    latest thing published at most fps times a second. Anything published while a frame is being drawn or waited out
+    is replaced by whatever comes after it, so drawing costs the same however fast samples arrive.
+    """
+
+    def __init__(self, screen, fps=5.0):
+        self.screen = screen
+        self.fps = fps
+        self.frames = 0
+        # Published items replaced before they were drawn
+        self.coalesced = 0
+        self.running = False
+        self.thread = None
+        self._latest = None
+        self._condition = Condition()
+
+    def publish(self, item):
+        with self._condition:
+            if self._latest is not None:
+                self.coalesced += 1
+            self._latest = item
+            self._condition.notify()
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, name='display')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Draws whatever was published last, then waits up to timeout seconds for the thread to finish
+        """
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def draw(self, item):
+        if isinstance(item, basestring):
+            self.screen.print_message(item)
+        else:
+            self.screen.print_dashboard(*item)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._latest is None and self.running:
+                    self._condition.wait(.5)
+                item, self._latest = self._latest, None
+            if item is None:
+                return
+
+            start = monotonic()
+            try:
+                self.draw(item)
+                self.frames += 1
+            except Exception as e:
+                logging.debug('display: {0}'.format(e))
+                logging.debug(traceback.format_exc())
+
+            sleep(max(1.0 / self.fps - (monotonic() - start), 0))
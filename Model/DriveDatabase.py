@@ -1,14 +1,132 @@
 __author__ = 'benradosevich'
 
 import sqlite3 as lite
+from threading import Lock, local
+from Clock import monotonic
+
+
+class Rollup(object):
+    """
+    Keeps count, sum, min and max of MPG and speed, plus distance and fuel used, for fixed-width time buckets of one
+    drive. Samples are folded in as they arrive, so dashboards and trip summaries read a handful of rollup rows instead
+    of averaging raw samples.
+    """
+
+    COLUMNS = ['DRIVE_ID', 'BUCKET', 'N', 'MPG_SUM', 'MPG_MIN', 'MPG_MAX', 'SPD_SUM', 'SPD_MIN', 'SPD_MAX',
+               'DISTANCE', 'FUEL']
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        # Timestamps are in milliseconds
+        self.width = seconds * 1000
+        self.table = 'rollup_{0}s'.format(seconds)
+        self.schema = [
+            'CREATE TABLE IF NOT EXISTS {0}(DRIVE_ID INT NOT NULL, BUCKET INT NOT NULL, N INT, MPG_SUM REAL, '
+            'MPG_MIN REAL, MPG_MAX REAL, SPD_SUM REAL, SPD_MIN REAL, SPD_MAX REAL, DISTANCE REAL, FUEL REAL, '
+            'PRIMARY KEY(DRIVE_ID, BUCKET))'.format(self.table),
+            'CREATE INDEX IF NOT EXISTS {0}_bucket ON {0}(BUCKET)'.format(self.table)
+        ]
+        # The open bucket is rewritten on every flush until it closes, hence REPLACE
+        self.insert = 'INSERT OR REPLACE INTO {0}({1}) VALUES({2})'.format(
+            self.table, ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS)))
+        self.__current = None
+        self.__closed = []
+
+    def add(self, drive, timestamp, mpg, speed, distance, fuel):
+        """
+        Folds one sample into its bucket. Buckets start at multiples of seconds.
+        """
+        bucket = timestamp - timestamp % self.width
+        row = self.__current
+        if row is None or row[0] != drive or row[1] != bucket:
+            if row is not None:
+                self.__closed.append(tuple(row))
+            row = self.__current = [drive, bucket, 0, 0.0, mpg, mpg, 0.0, speed, speed, 0.0, 0.0]
+
+        row[2] += 1
+        row[3] += mpg
+        row[4] = min(row[4], mpg)
+        row[5] = max(row[5], mpg)
+        row[6] += speed
+        row[7] = min(row[7], speed)
+        row[8] = max(row[8], speed)
+        row[9] += distance
+        row[10] += fuel
+
+    def take_rows(self):
+        """
+        Returns the buckets closed since the last call plus the current, still open, bucket
+        """
+        rows, self.__closed = self.__closed, []
+        if self.__current is not None:
+            rows.append(tuple(self.__current))
+        return rows
 
 
 class DriveDatabase(object):
+    """
+    Every drive's samples live in one samples table keyed by (DRIVE_ID, TIMESTAMP), with a row per drive in drives.
+    Timestamps, including drives.STARTED and rollup BUCKETs, are UTC milliseconds.
+    Cross-drive queries like "MPG over the last 30 days" are a range scan on the TIMESTAMP index.
+    """
+
+    # Columns written for every sample, in insert order
+    COLUMNS = ['TIMESTAMP', 'MPG', 'SPD', 'LAT', 'LON', 'TRA']
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS drives(DRIVE_ID INTEGER PRIMARY KEY, STARTED INT NOT NULL, '
+        'LEGACY_TABLE VARCHAR UNIQUE)',
+        'CREATE INDEX IF NOT EXISTS drives_started ON drives(STARTED)',
+        'CREATE TABLE IF NOT EXISTS samples(DRIVE_ID INT NOT NULL REFERENCES drives(DRIVE_ID), TIMESTAMP INT NOT NULL, '
+        'MPG REAL, SPD REAL, LAT REAL, LON REAL, TRA REAL, PRIMARY KEY(DRIVE_ID, TIMESTAMP))',
+        'CREATE INDEX IF NOT EXISTS samples_timestamp ON samples(TIMESTAMP)'
+    ]
 
-    def __init__(self, path):
+    # Bucket widths, in seconds, of the rollup_[n]s tables kept up to date while logging
+    ROLLUPS = [1, 10, 60]
+
+    # A sample that repeats a timestamp already written for the drive is dropped rather than failing its whole batch
+    INSERT = 'INSERT OR IGNORE INTO samples(DRIVE_ID, {0}) VALUES(?, {1})'.format(
+        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+    # Storage profiles. 'sdcard' puts the db in write-ahead-log mode so commits append to the WAL without an fsync and
+    # readers don't block the writer. The WAL is only synced and copied into the db at checkpoints, which we run when
+    # the car is stopped, or after max_checkpoint_interval seconds regardless, so a hard power cut loses at most
+    # flush_interval + max_checkpoint_interval seconds of samples.
+    PROFILES = {
+        'sdcard': {'pragmas': [('journal_mode', 'WAL'),
+                               ('synchronous', 'NORMAL'),
+                               ('cache_size', -4096),   # KiB
+                               ('wal_autocheckpoint', 0)],
+                   'checkpoint_interval': 30.0,
+                   'max_checkpoint_interval': 120.0},
+        'default': {'pragmas': [],
+                    'checkpoint_interval': None,
+                    'max_checkpoint_interval': None}
+    }
+
+    def __init__(self, path, flush_rows=50, flush_interval=5.0, profile='sdcard'):
+        """
+        Rows are buffered and committed together once flush_rows have piled up or flush_interval seconds have passed
+        since the last commit, whichever comes first. Each commit is an fsync, the slowest thing we do on the SD card.
+        profile is one of PROFILES.
+        """
         self.__path = path
+        self.profile = self.PROFILES[profile]
         self.open = False
-        self.__current_table = None
+        self.__current_drive = None
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.__connection = None
+        self.__buffer = []
+        self.__rollups = [Rollup(seconds) for seconds in self.ROLLUPS]
+        self.__last_flush = monotonic()
+        self.__last_checkpoint = monotonic()
+        # The connection is opened on the main thread but written to from the run loop
+        self.__lock = Lock()
+        # query() readers get a connection per thread so they can run alongside the writer
+        self.__readers = local()
+        self.__reader_connections = []
 
     @property
     def path(self):
@@ -22,47 +140,164 @@ class DriveDatabase(object):
         self.__path = p
 
     @property
-    def current_table(self):
-        return self.__current_table
+    def current_drive(self):
+        """
+        DRIVE_ID of the drive being logged
+        """
+        return self.__current_drive
 
-    def new_table(self, timestamp):
+    def connect(self):
         """
-        Creates a unique table in the db for the current drive. Table name is in format D[unique timestamp]. Need first
-        character to be alpha for sqlite3.
+        Opens the long-lived connection to the database, if it isn't open already. Creates the schema and imports any
+        old per-drive tables the first time.
         """
-        name = 'D' + str(timestamp)
-        self.__current_table = name
-        con = lite.connect(self.path)
+        if self.__connection is None:
+            self.__connection = lite.connect(self.path, check_same_thread=False)
+            self.open = True
+            for pragma, value in self.profile['pragmas']:
+                self.__connection.execute('PRAGMA {0} = {1}'.format(pragma, value))
+            with self.__lock, self.__connection as con:
+                for statement in self.SCHEMA + sum((rollup.schema for rollup in self.__rollups), []):
+                    con.execute(statement)
+            self.migrate()
+        return self.__connection
 
-        with con:
-            cur = con.cursor()
-            cur.execute('CREATE TABLE {0}(TIMESTAMP INT PRIMARY KEY, MPG REAL, '
-                        'SPD REAL, LAT REAL, LON REAL, TRA VARCHAR)'.format(name))
+    def migrate(self):
+        """
+        Imports the D[timestamp] tables older versions created for each drive into drives and samples. Old tables are
+        left in place; the LEGACY_TABLE column keeps them from being imported twice.
+        """
+        con = self.connect()
 
-    def write_values(self, data):
+        with self.__lock:
+            tables = [row[0] for row in con.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'D[0-9]*' "
+                "AND name NOT IN (SELECT LEGACY_TABLE FROM drives WHERE LEGACY_TABLE IS NOT NULL)")]
+
+            for table in tables:
+                with con:
+                    cur = con.cursor()
+                    cur.execute('INSERT INTO drives(STARTED, LEGACY_TABLE) VALUES(?, ?)',
+                                (int(table[1:]) * 1000, table))
+                    # Old tables stored whole seconds, and the track as text
+                    cur.execute('INSERT OR IGNORE INTO samples(DRIVE_ID, {0}) '
+                                'SELECT ?, TIMESTAMP * 1000, MPG, SPD, LAT, LON, CAST(TRA AS REAL) FROM {1}'.format(
+                                    ', '.join(self.COLUMNS), table), (cur.lastrowid,))
+
+    def new_drive(self, timestamp):
         """
-        Takes absolute path of db, table name, and dict with column:value format, writes selected data to db.
+        Adds a row to drives for a drive starting at timestamp and makes it the drive samples are written to
         """
-        # TODO: maybe enclose strings in quotes to prevent "no such column NaN" when gps fix lost?
-        keys = ['TIMESTAMP', 'MPG', 'SPD', 'LAT', 'LON', 'TRA']
-        values = [data[k] for k in keys]
-        columns = ', '.join(keys)
-        values = ', '.join(values)
-        con = lite.connect(self.path)
+        self.flush()
+        con = self.connect()
 
-        with con:
+        with self.__lock, con:
             cur = con.cursor()
-            cur.execute('INSERT INTO {0}({1}) VALUES({2})'.format(self.__current_table, columns, values))
+            cur.execute('INSERT INTO drives(STARTED) VALUES(?)', (timestamp,))
+            self.__current_drive = cur.lastrowid
+
+        return self.__current_drive
+
+    def write_values(self, sample):
+        """
+        Buffers a Sample for writing to db. NaN (e.g. lat/lon when the gps fix is lost) is stored as NULL.
+        """
+        to_sql = self.to_sql
+        self.__buffer.append((self.__current_drive, sample.timestamp, to_sql(sample.mpg), to_sql(sample.speed),
+                              to_sql(sample.lat), to_sql(sample.lon), to_sql(sample.track)))
+        for rollup in self.__rollups:
+            rollup.add(self.__current_drive, sample.timestamp, sample.mpg, sample.speed, sample.distance, sample.fuel)
+
+        if len(self.__buffer) >= self.flush_rows or monotonic() - self.__last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered rows and the rollups they touched to the db in a single transaction
+        """
+        self.__last_flush = monotonic()
+        if not self.__buffer:
+            return
+
+        con = self.connect()
+
+        with self.__lock, con:
+            rows, self.__buffer = self.__buffer, []
+            con.executemany(self.INSERT, rows)
+            for rollup in self.__rollups:
+                con.executemany(rollup.insert, rollup.take_rows())
+
+    def maybe_checkpoint(self, stopped):
+        """
+        Checkpoints the WAL if the car is stopped and checkpoint_interval has passed since the last one, or if
+        max_checkpoint_interval has passed whether we're stopped or not. Called after every sample.
+        """
+        interval = self.profile['checkpoint_interval']
+        if interval is None:
+            return False
+
+        elapsed = monotonic() - self.__last_checkpoint
+        if (stopped and elapsed >= interval) or elapsed >= self.profile['max_checkpoint_interval']:
+            self.checkpoint()
+            return True
+        return False
+
+    def checkpoint(self):
+        """
+        Commits buffered rows and copies the WAL back into the db file, syncing both
+        """
+        self.flush()
+        self.__last_checkpoint = monotonic()
+        con = self.connect()
+
+        with self.__lock:
+            # PASSIVE never waits on readers; frames a reader still needs are picked up by the next checkpoint
+            con.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    @staticmethod
+    def to_sql(value):
+        """
+        Maps NaN to None so it's stored as NULL
+        """
+        if value != value:
+            return None
+        return value
+
+    def close(self):
+        """
+        Flushes any buffered rows and closes the connections
+        """
+        if self.profile['checkpoint_interval'] is not None:
+            self.checkpoint()
+        else:
+            self.flush()
+        for con in self.__reader_connections:
+            con.close()
+        self.__reader_connections = []
+        self.__readers = local()
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+        self.open = False
 
     def query(self, q):
         """
-        @param q: sqlite query with {0} for table name
+        @param q: sqlite query with {0} for the current drive's DRIVE_ID
+        Runs on the calling thread's own connection, so it doesn't wait on the logger. Rows still in the write buffer
+        aren't visible until the next flush.
         """
-        con = lite.connect(self.path)
+        con = getattr(self.__readers, 'connection', None)
+        if con is None:
+            # Make sure the schema exists before the first read
+            self.connect()
+            con = lite.connect(self.path, check_same_thread=False)
+            self.__readers.connection = con
+            self.__reader_connections.append(con)
 
-        with con:
-            cur = con.cursor()
-            cur.execute(q.format(self.__current_table))
-            response = cur.fetchone()
+        cur = con.cursor()
+        cur.execute(q.format(self.__current_drive))
+        response = cur.fetchone()
+        # End the read transaction so it doesn't hold back checkpoints
+        con.commit()
 
         return response
@@ -0,0 +1,151 @@
+########################################################################################################################
+# Binary log of everything a drive's instruments said, for replaying later without the car.                          #
+# The file is MAGIC followed by records, each a HEADER (record type, milliseconds since the log started) and a body:   #
+# OBD:  OBD_RECORD (ms the request took, command length, response length), command, raw response                       #
+# GPS:  GPS_RECORD (mode, UTC epoch seconds or NaN without one, latitude, longitude, track, speed)                     #
+########################################################################################################################
+
+import struct
+from threading import Lock
+from Clock import GPSClock, monotonic
+from GPSSource import GPSFix, MODE_2D
+from OBDController import OBDController, NoOBDDataException
+from Sample import Sample
+
+MAGIC = b'CARPUTER DRIVE 1\n'
+OBD, GPS = 1, 2
+HEADER = struct.Struct('<BI')
+OBD_RECORD = struct.Struct('<HBH')
+GPS_RECORD = struct.Struct('<Bdddff')
+
+
+class DriveLogWriter(object):
+    """
+    Records OBD responses and GPS fixes as they arrive. Set it as an OBDController's and a GPS source's recorder;
+    they call obd() and gps() from their reader threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._started = monotonic()
+        self._lock = Lock()
+
+    def _write(self, kind, received, body):
+        header = HEADER.pack(kind, max(int(round((received - self._started) * 1000)), 0))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(header + body)
+                self.records += 1
+
+    def obd(self, command, response, latency, received=None):
+        """
+        Records the raw response to command, which took latency seconds to arrive, at monotonic() time received (now if
+        not given). The response is stored byte for byte, line noise and all.
+        """
+        self._write(OBD, monotonic() if received is None else received,
+                    OBD_RECORD.pack(min(int(round(latency * 1000)), 0xFFFF), len(command), len(response)) +
+                    command + response)
+
+    def gps(self, fix):
+        utc = GPSClock.parse_utc(fix.utc) if fix.utc else float('nan')
+        self._write(GPS, fix.received, GPS_RECORD.pack(fix.mode, utc, fix.latitude, fix.longitude, fix.track,
+                                                       fix.speed))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_log(path):
+    """
+    Yields a drive log's records in order: ('obd', t, command, response, latency) or ('gps', t, fix), where t is seconds
+    since the log started. A record cut short by a power cut ends the log.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a drive log'.format(path))
+
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            kind, ms = HEADER.unpack(header)
+            t = ms / 1000.0
+
+            if kind == OBD:
+                body = f.read(OBD_RECORD.size)
+                if len(body) < OBD_RECORD.size:
+                    return
+                latency, command_length, response_length = OBD_RECORD.unpack(body)
+                text = f.read(command_length + response_length)
+                if len(text) < command_length + response_length:
+                    return
+                yield 'obd', t, text[:command_length], text[command_length:], latency / 1000.0
+
+            elif kind == GPS:
+                body = f.read(GPS_RECORD.size)
+                if len(body) < GPS_RECORD.size:
+                    return
+                mode, utc, latitude, longitude, track, speed = GPS_RECORD.unpack(body)
+                utc = None if utc != utc else GPSClock.format_utc(utc)
+                yield 'gps', t, GPSFix(mode, utc, latitude, longitude, track, speed, t)
+
+            else:
+                raise ValueError('Unknown record type {0} in {1}'.format(kind, path))
+
+
+def replay(path, carputer, draw=True):
+    """
+    Feeds a recorded drive through carputer as fast as it will go: each speed and MAF response becomes a Sample that
+    goes through process_data and into the db, timed by the log rather than the clock. With draw, the display draws the
+    frames it would have drawn on the road, one per 1 / fps seconds of log time, on this thread. Samples without a GPS
+    fix are skipped, as on the road. Returns the number of samples replayed.
+    """
+    fix = None
+    # UTC seconds minus log seconds, from the first fix
+    offset = None
+    last = None
+    next_frame = 0.0
+    samples = 0
+
+    for record in read_log(path):
+        if record[0] == 'gps':
+            _, t, fix = record
+            if offset is None and GPSClock.has_time(fix):
+                offset = GPSClock.parse_utc(fix.utc) - t
+            continue
+
+        _, t, command, response, latency = record
+        if offset is None or fix.mode < MODE_2D or not command.startswith('01'):
+            continue
+        # Requests carry a trailing response count
+        command = command[:len(command) - len(command) % 2]
+        try:
+            data = OBDController.split_response(command, response)
+        except NoOBDDataException:
+            continue
+        if '010D' not in data or '0110' not in data:
+            continue
+
+        mpg, speed = carputer.compute_mpg(data)
+        start = last if last is not None else t - latency
+        last = t
+        timestamp = int((offset + t) * 1000)
+        if carputer.db.current_drive is None:
+            carputer.db.new_drive(timestamp)
+
+        sample = Sample(timestamp, mpg, speed, fix.latitude, fix.longitude, fix.track, t - start)
+        trip = carputer.process_data(sample)
+        carputer.store(sample)
+        if draw and t >= next_frame:
+            carputer.display.draw(trip)
+            next_frame = t + 1.0 / carputer.display.fps
+        samples += 1
+
+    carputer.db.flush()
+    return samples
@@ -4,38 +4,23 @@ Original author is Martin O'Hanlon. Modified for threading.
 """
 
 from gps import *
-import threading
+from Clock import monotonic
+from GPSSource import GPSSource, GPSFix
 
 
-class GPSController():
+class GPSController(GPSSource):
     def __init__(self):
+        super(GPSController, self).__init__()
         self.gpsd = gps(mode=WATCH_ENABLE)
-        self.running = False
-        self.thread = None
 
     def update(self):
         while self.running:
-            self.gpsd.next()
-
-    # todo: this and stop() changed 11/22. if gps issues, investigate here
-    def start(self):
-        self.running = True
-        self.thread = threading.Thread(target=self.update)
-        self.thread.start()
-
-    def stop(self):
-        self.running = False
-        self.thread.join()
-
-    @property
-    def fix(self):
-        return self.gpsd.fix
-
-    @property
-    def has_fix(self):
-        return self.gpsd.fix.mode != 1
-
-    @property
-    def time(self):
-        # fix.time alternately returns date string or epoch, with no regularity
-        return self.gpsd.utc.split('.')[0]  # Format: u'2016-01-03T22:51:50'
+            # Wait with a timeout rather than blocking in next(), so stop() is noticed even if gpsd goes quiet
+            if not self.gpsd.waiting(0.5):
+                continue
+            report = self.gpsd.next()
+            if report['class'] == 'TPV':
+                fix = self.gpsd.fix
+                # fix.time alternately returns date string or epoch, with no regularity, so use utc
+                self._publish(GPSFix(fix.mode, self.gpsd.utc, fix.latitude, fix.longitude, fix.track, fix.speed,
+                                     monotonic()))
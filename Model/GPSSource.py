@@ -0,0 +1,93 @@
+import logging
+import threading
+import traceback
+from collections import namedtuple
+from time import time
+
+# Fix modes, as gpsd numbers them
+MODE_NO_FIX = 1
+MODE_2D = 2
+MODE_3D = 3
+
+# The reader thread starts before Carputer has set up the drive's log; see OBDController
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+# Copy of one position report. A new one replaces the old on every report, so a reader holding one never sees it
+# change halfway through. utc is an ISO 8601 string (None or empty in some reports without a fix), speed is in m/s
+# and received is the monotonic() time the report came in.
+GPSFix = namedtuple('GPSFix', 'mode utc latitude longitude track speed received')
+
+
+class GPSSource(object):
+    """
+    Base for GPS controllers. Subclasses read reports in update(), which runs on its own thread while running is
+    True, and hand each one to _publish() as a GPSFix.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self._snapshot = None
+        # Gets every report too, if set; see DriveLog.DriveLogWriter
+        self.recorder = None
+        # Notified whenever a report with a fix comes in
+        self._fix_ready = threading.Condition()
+
+    def update(self):
+        raise NotImplementedError
+
+    def _publish(self, snapshot):
+        if self.recorder is not None:
+            # A recorder that fails mustn't stop the reports, or has_fix would be stuck at its last value
+            try:
+                self.recorder.gps(snapshot)
+            except Exception as e:
+                log.debug('GPS recorder: {0}, no longer recording fixes'.format(e))
+                log.debug(traceback.format_exc())
+                self.recorder = None
+        with self._fix_ready:
+            self._snapshot = snapshot
+            if snapshot.mode >= MODE_2D:
+                self._fix_ready.notify_all()
+
+    # todo: this and stop() changed 11/22. if gps issues, investigate here
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.update)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2)
+
+    def wait_for_fix(self, timeout=None):
+        """
+        Blocks until a report with a fix arrives or timeout seconds pass. Returns True if we have a fix.
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self._fix_ready:
+            while not self.has_fix:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    break
+                # Condition.wait without a timeout can't be interrupted on Python 2, so wake up now and then
+                self._fix_ready.wait(1 if remaining is None else min(remaining, 1))
+        return self.has_fix
+
+    @property
+    def fix(self):
+        """
+        Latest GPSFix, or None before the first report
+        """
+        return self._snapshot
+
+    @property
+    def has_fix(self):
+        snapshot = self._snapshot
+        return snapshot is not None and snapshot.mode >= MODE_2D
+
+    @property
+    def time(self):
+        return self._snapshot.utc.split('.')[0]  # Format: u'2016-01-03T22:51:50'
@@ -0,0 +1,238 @@
+########################################################################################################################
+# Reads the u-blox NEO-6M's serial port directly instead of going through gpsd.                                      #
+# Protocol reference: u-blox 6 Receiver Description including Protocol Specification (GPS.G6-SW-10018)               #
+# NMEA sentences look like '$GPRMC,225150.00,A,4736.000,N,12218.000,W,0.5,90.0,030116,,,A*6F\r\n'; the two hex digits  #
+# after '*' are the XOR of every character between '$' and '*'.                                                      #
+########################################################################################################################
+
+import serial
+import struct
+from Clock import monotonic
+from GPSSource import GPSSource, GPSFix, MODE_NO_FIX, MODE_2D, MODE_3D
+
+KNOTS_TO_MPS = 0.514444
+KPH_TO_MPS = 1 / 3.6
+
+
+def ubx_message(msg_class, msg_id, payload):
+    """
+    Frames a UBX message: sync chars, class, id, little-endian length, payload and 8-bit Fletcher checksum
+    """
+    body = struct.pack('<BBH', msg_class, msg_id, len(payload)) + payload
+    ck_a = ck_b = 0
+    for byte in bytearray(body):
+        ck_a = (ck_a + byte) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return b'\xb5\x62' + body + struct.pack('<BB', ck_a, ck_b)
+
+
+def cfg_rate(hz):
+    """
+    CFG-RATE: measurement period in ms, one navigation solution per measurement, aligned to GPS time
+    """
+    return ubx_message(0x06, 0x08, struct.pack('<HHH', int(1000 / hz), 1, 1))
+
+
+def cfg_msg(nmea_id, rate):
+    """
+    CFG-MSG: how often (per navigation solution) the current port outputs standard NMEA sentence nmea_id; 0 turns it off
+    """
+    return ubx_message(0x06, 0x01, struct.pack('<BBB', 0xF0, nmea_id, rate))
+
+
+def cfg_prt(baudrate):
+    """
+    CFG-PRT: UART1 at baudrate, 8N1, UBX and NMEA in, NMEA out
+    """
+    return ubx_message(0x06, 0x00, struct.pack('<BBHIIHHHH', 1, 0, 0, 0x08D0, baudrate, 0x0003, 0x0002, 0, 0))
+
+
+class NMEAParser(object):
+    """
+    Incremental parser for GGA, RMC and VTG sentences. feed() takes bytes as they come off the serial port, in chunks
+    of any size, and returns the sentences completed by them as (type, fields) tuples, where fields is a dict of
+    decoded values. Sentences with a bad checksum, and types we don't use, are skipped.
+    """
+
+    # Longest legal NMEA sentence is 82 characters; anything longer without a newline is noise
+    MAX_LENGTH = 128
+
+    def __init__(self):
+        self._buf = b''
+        self.bad_checksums = 0
+
+    def feed(self, data):
+        self._buf += data
+        sentences = []
+        while b'\n' in self._buf:
+            line, self._buf = self._buf.split(b'\n', 1)
+            sentence = self.parse(line.strip())
+            if sentence is not None:
+                sentences.append(sentence)
+        if len(self._buf) > self.MAX_LENGTH:
+            self._buf = b''
+        return sentences
+
+    @staticmethod
+    def checksum_ok(line):
+        if not line.startswith(b'$') or b'*' not in line:
+            return False
+        body, checksum = line[1:].rsplit(b'*', 1)
+        expected = 0
+        for byte in bytearray(body):
+            expected ^= byte
+        try:
+            return int(checksum[:2], 16) == expected
+        except ValueError:
+            return False
+
+    def parse(self, line):
+        if not self.checksum_ok(line):
+            if line.startswith(b'$'):
+                self.bad_checksums += 1
+            return None
+
+        fields = line[1:].rsplit(b'*', 1)[0].decode('ascii').split(',')
+        # The first two characters are the talker ('GP', or 'GN' on multi-constellation receivers)
+        kind = fields[0][2:]
+        parser = {'GGA': self._gga, 'RMC': self._rmc, 'VTG': self._vtg}.get(kind)
+        if parser is None:
+            return None
+        try:
+            return kind, parser(fields)
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _float(value):
+        return float(value) if value else float('nan')
+
+    @staticmethod
+    def _coordinate(value, hemisphere):
+        """
+        Converts NMEA's [d]ddmm.mmmm plus hemisphere to signed decimal degrees
+        """
+        if not value:
+            return float('nan')
+        point = value.index('.')
+        degrees = int(value[:point - 2]) + float(value[point - 2:]) / 60.0
+        return -degrees if hemisphere in ('S', 'W') else degrees
+
+    @staticmethod
+    def _time(value):
+        # hhmmss.ss
+        return '{0}:{1}:{2}'.format(value[0:2], value[2:4], value[4:])
+
+    def _gga(self, f):
+        return {'time': self._time(f[1]) if f[1] else None,
+                'latitude': self._coordinate(f[2], f[3]),
+                'longitude': self._coordinate(f[4], f[5]),
+                'quality': int(f[6] or 0),
+                'satellites': int(f[7] or 0),
+                'altitude': self._float(f[9])}
+
+    def _rmc(self, f):
+        date = f[9]
+        return {'time': self._time(f[1]) if f[1] else None,
+                'valid': f[2] == 'A',
+                'latitude': self._coordinate(f[3], f[4]),
+                'longitude': self._coordinate(f[5], f[6]),
+                'speed': self._float(f[7]) * KNOTS_TO_MPS,
+                'track': self._float(f[8]),
+                # ddmmyy
+                'date': '20{0}-{1}-{2}'.format(date[4:6], date[2:4], date[0:2]) if date else None}
+
+    def _vtg(self, f):
+        return {'track': self._float(f[1]),
+                'speed': self._float(f[7]) * KPH_TO_MPS}
+
+
+class NMEAGPSController(GPSSource):
+    """
+    GPS controller that talks NMEA to the receiver over its serial port, with no gpsd in between. On start it switches
+    the receiver to fast_baudrate, turns off the sentences we don't parse and raises the update rate to rate Hz, which
+    the 9600 baud default can't carry.
+    """
+
+    # Standard NMEA sentence ids for CFG-MSG
+    GLL, GSA, GSV = 0x01, 0x02, 0x03
+
+    def __init__(self, path='/dev/ttyAMA0', baudrate=9600, fast_baudrate=38400, rate=5):
+        super(NMEAGPSController, self).__init__()
+        self._path = path
+        self._baudrate = baudrate
+        self._fast_baudrate = fast_baudrate
+        self._rate = rate
+        self._connection = None
+        self.parser = NMEAParser()
+        # Pieces of the current fix, merged from whichever sentences have come in
+        self._date = None
+        self._time = None
+        self._mode = MODE_NO_FIX
+        self._latitude = self._longitude = self._track = self._speed = float('nan')
+
+    def configure(self):
+        """
+        Sends the UBX configuration. The receiver doesn't acknowledge in a way we wait for; if it didn't take, we just
+        keep getting NMEA at the default rate.
+        """
+        if self._fast_baudrate and self._fast_baudrate != self._baudrate:
+            self._connection.write(cfg_prt(self._fast_baudrate))
+            self._connection.flush()
+            self._connection.baudrate = self._fast_baudrate
+        for sentence in self.GLL, self.GSA, self.GSV:
+            self._connection.write(cfg_msg(sentence, 0))
+        self._connection.write(cfg_rate(self._rate))
+
+    def start(self):
+        self._connection = serial.Serial(self._path, self._baudrate, timeout=0.5)
+        self.configure()
+        super(NMEAGPSController, self).start()
+
+    def stop(self):
+        super(NMEAGPSController, self).stop()
+        if self._connection is not None:
+            self._connection.close()
+
+    def update(self):
+        while self.running:
+            self.feed(self._connection.read(self._connection.inWaiting() or 1))
+
+    def feed(self, data):
+        """
+        Parses raw bytes from the receiver and publishes a new fix for every sentence they complete
+        """
+        for kind, fields in self.parser.feed(data):
+            if kind == 'GGA':
+                self._time = fields['time'] or self._time
+                if fields['quality'] == 0:
+                    self._mode = MODE_NO_FIX
+                else:
+                    # GGA doesn't say 2D or 3D; four satellites is the least a 3D fix needs
+                    self._mode = MODE_3D if fields['satellites'] >= 4 else MODE_2D
+                    self._latitude, self._longitude = fields['latitude'], fields['longitude']
+            elif kind == 'RMC':
+                self._time = fields['time'] or self._time
+                self._date = fields['date'] or self._date
+                if fields['valid']:
+                    self._mode = max(self._mode, MODE_2D)
+                    self._latitude, self._longitude = fields['latitude'], fields['longitude']
+                    # Course is left blank while stationary, so keep the last one
+                    if fields['track'] == fields['track']:
+                        self._track = fields['track']
+                    if fields['speed'] == fields['speed']:
+                        self._speed = fields['speed']
+                else:
+                    self._mode = MODE_NO_FIX
+            elif kind == 'VTG':
+                if fields['track'] == fields['track']:
+                    self._track = fields['track']
+                if fields['speed'] == fields['speed']:
+                    self._speed = fields['speed']
+
+            # No date until the first RMC, so hold off publishing anything timestamp-less
+            if self._date is None or self._time is None:
+                continue
+            utc = '{0}T{1}Z'.format(self._date, self._time)
+            self._publish(GPSFix(self._mode, utc, self._latitude, self._longitude, self._track, self._speed,
+                                 monotonic()))
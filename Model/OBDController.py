@@ -6,10 +6,23 @@
 # Responses are in format                                                                                              #
 # 010D SPEED FORMAT '010D\r41 0D 00 \r\r'                                                                              #
 # 0110 MAF FORMAT '0110\r41 10 01 7B \r\r'                                                                             #
+# Up to six mode 01 PIDs can be packed into one request, e.g. '010D10' for speed and MAF, and the ECU answers them all  #
+# in one response '010D10\r41 0D 00 10 01 7B \r\r'. Longer answers are split into numbered ISO-TP frames ('0: ...').    #
 ########################################################################################################################
 
+import logging
 import serial
-from DecodeFunctions import decode_obd_data
+import traceback
+from string import hexdigits
+from collections import deque
+from threading import Thread, Event, Lock
+from Clock import monotonic
+from DecodeFunctions import decode_obd_data, PID_LENGTHS
+
+# connect() runs before Carputer has set up the drive's log, and logging.debug() on the root logger at that point would
+# configure a stderr handler that stops the drive's log from ever being set up
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
 
 
 class NoOBDDataException(Exception):
@@ -19,53 +32,513 @@ class NoOBDDataException(Exception):
         self.response = response
 
 
+class OBDFuture(object):
+    """
+    Pending answer to a command queued with OBDController. The reader thread fills it in when the adapter's '>' prompt
+    arrives, so the caller can carry on with other work and only block in result() once it needs the data.
+    """
+
+    def __init__(self, command, parser):
+        self.command = command
+        self.sent_at = None
+        self.completed_at = None
+        self._parser = parser
+        self._done = Event()
+        self._result = None
+        self._exception = None
+        # Guards _callbacks and finishing, so a callback added while the reader thread finishes is called exactly once
+        self._lock = Lock()
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Blocks until the response is in, returns the parsed response. Raises NoOBDDataException if nothing arrives
+        within timeout seconds or the response couldn't be parsed.
+        """
+        if not self._done.wait(timeout):
+            raise NoOBDDataException(self.command, None)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(future) once the response is in. Called straight away if it already is.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_response(self, response):
+        try:
+            self._result = self._parser(response)
+        except Exception as e:
+            self._exception = e
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self.completed_at = monotonic()
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
 class OBDController():
 
-    def __init__(self, path, DEBUG=False):
-        self._baudrate = 38400
+    # ELM327 accepts at most six PIDs in a single mode 01 request
+    MAX_PIDS = 6
+
+    # Settings that only shorten responses, each with the command that undoes it. Kept whenever the adapter takes them
+    # and still answers the probe.
+    TRIMS = [('ATE0', 'ATE1'),      # Echo off
+             ('ATS0', 'ATS1'),      # No spaces between bytes
+             ('ATL0', 'ATL1')]      # No linefeeds after carriage returns
+    # Settings that may or may not help, kept only if the probe gets faster
+    TIMED = [('ATAT2', 'ATAT1')]    # Aggressive adaptive timing
+    # The adapter's rate after a reset, and the rates tried after the settings, slowest first. The adapter's baud rate
+    # divisor is based on 4 MHz.
+    DEFAULT_BAUDRATE = 38400
+    BAUDRATES = [57600, 115200, 230400, 500000]
+    # Command timed while tuning; the same speed and MAF request the run loop sends
+    PROBE = '010D10'
+    PROBE_COUNT = 5
+
+    def __init__(self, path, DEBUG=False, response_timeout=1.0, connection=None):
+        """
+        connection, if given, is used in place of opening the serial port at path; anything with pyserial's read,
+        write, inWaiting, flushInput, close and baudrate will do, e.g. a Simulators.ELM327Simulator
+        """
+        self._baudrate = self.DEFAULT_BAUDRATE
         self._path = path
         self._debug = DEBUG
+        self._given_connection = connection
         self._connection = None
+        self.response_timeout = response_timeout
+
+        # The adapter only handles one command at a time, so requests wait in _pending until the reader thread sees the
+        # prompt for the one in flight
+        self._lock = Lock()
+        self._pending = deque()
+        self._in_flight = None
+        self._reading = False
+        self._reader = None
+        self.settings = []
+        self.latency = None
+        # Gets every raw response too, if set; see DriveLog.DriveLogWriter
+        self.recorder = None
 
-    def connect(self):
-        # todo: set locale? turn echo off?
+    def connect(self, tune=True):
+        # todo: set locale?
         if self._debug:
             self._connection = True
             return True
 
         try:
-            self._connection = serial.Serial(self._path, self._baudrate, timeout=1)
-            return True
+            if self._given_connection is not None:
+                self._connection = self._given_connection
+                self._connection.baudrate = self._baudrate
+            else:
+                self._connection = serial.Serial(self._path, self._baudrate, timeout=0.1)
 
         except Exception as e:
             self._connection = None
             return False
 
-    # def check_trouble(self):
-    #     # this needs work
-    #
-    #     command = '03\r'
-    #     self._connection.write(command)
-    #     return self._connection.readline()
+        if tune:
+            self.tune()
+            self._connection.flushInput()
+
+        self._reading = True
+        self._reader = Thread(target=self._read_loop)
+        self._reader.daemon = True
+        self._reader.start()
+        return True
+
+    def tune(self):
+        """
+        Trims the adapter's responses, then tries the timed settings and higher baud rates, keeping each of those only
+        if the probe request answers faster than the best so far. Talks to the adapter directly, so it must run before
+        the reader thread starts.
+        """
+        # Clear out anything left over from before we connected so the first probe starts from a clean prompt
+        self._connection.flushInput()
+        identity = self._transact('ATI')
+        self.latency = self._probe()
+        if self.latency is None and 'ELM' not in identity and self._find_baudrate():
+            self.latency = self._probe()
+        if self.latency is None:
+            log.debug('OBD tuning skipped, probe {0} got no answer at {1} baud'.format(self.PROBE, self._baudrate))
+            return
+
+        for setting, undo in self.TRIMS:
+            if 'OK' not in self._transact(setting):
+                continue
+            if self._probe() is None:
+                self._transact(undo)
+            else:
+                self.settings.append(setting)
+        if self.settings:
+            # Trimmed responses are the baseline the timed changes have to beat
+            self.latency = self._probe() or self.latency
+
+        for setting, undo in self.TIMED:
+            if 'OK' not in self._transact(setting):
+                continue
+            latency = self._probe()
+            if latency is not None and latency < self.latency:
+                self.latency = latency
+                self.settings.append(setting)
+            else:
+                self._transact(undo)
+
+        for baudrate in self.BAUDRATES:
+            if baudrate <= self._baudrate:
+                continue
+            previous = self._baudrate
+            if not self._switch_baudrate(baudrate):
+                break
+            latency = self._probe()
+            if latency is None or latency >= self.latency:
+                self._switch_baudrate(previous)
+                break
+            self.latency = latency
+
+        log.debug('OBD tuned: settings {0}, {1} baud, {2:.4f} s per request'.format(
+            self.settings, self._baudrate, self.latency))
+
+    def _probe(self):
+        """
+        Returns the average round-trip time of PROBE, or None if any of the answers were missing or garbled
+        """
+        start = monotonic()
+        for _ in xrange(self.PROBE_COUNT):
+            try:
+                self.split_response(self.PROBE, self._transact(self.PROBE + '1'))
+            except NoOBDDataException:
+                return None
+        return (monotonic() - start) / self.PROBE_COUNT
+
+    def _find_baudrate(self):
+        """
+        Looks for the adapter at each of BAUDRATES, in case it kept a rate a previous run tuned it to without being
+        reset. Returns True if it answered at one of them, leaving both ends on that rate.
+        """
+        for baudrate in self.BAUDRATES:
+            self._connection.baudrate = baudrate
+            self._connection.flushInput()
+            # Ends whatever half-command the garbage so far left in the adapter's buffer
+            self._transact('')
+            if 'ELM' in self._transact('ATI'):
+                log.debug('OBD adapter found at {0} baud'.format(baudrate))
+                self._baudrate = baudrate
+                return True
+
+        self._connection.baudrate = self._baudrate
+        self._connection.flushInput()
+        return False
+
+    def _switch_baudrate(self, baudrate):
+        """
+        Walks the adapter through an ATBRD baud rate change. The adapter answers OK, switches, sends its ID string at
+        the new rate and only keeps the new rate if we answer with a carriage return before it times out.
+        Returns True if both ends are now on baudrate.
+        """
+        divisor = int(round(4000000.0 / baudrate))
+        response = self._transact('ATBRD {0:02X}'.format(divisor), 'OK')
+        if 'OK' not in response:
+            # Clones often don't support ATBRD
+            return False
+
+        self._connection.baudrate = baudrate
+        if 'ELM' not in response:
+            response = self._read_until('\r')
+        if 'ELM' in response and '>' in self._transact(''):
+            self._baudrate = baudrate
+            return True
+
+        # The adapter drops back to the old rate on its own
+        self._connection.baudrate = self._baudrate
+        self._connection.flushInput()
+        return False
+
+    def _transact(self, command, terminator='>'):
+        """
+        Sends command and blocks until terminator arrives or response_timeout passes. Only for use while the reader
+        thread isn't running.
+        """
+        self._connection.write(command + '\r')
+        return self._read_until(terminator)
+
+    def _read_until(self, terminator):
+        response = ''
+        deadline = monotonic() + self.response_timeout
+        while terminator not in response and monotonic() < deadline:
+            response += self._connection.read(self._connection.inWaiting() or 1)
+        return response
+
+    def _read_loop(self):
+        """
+        Runs on the reader thread. Collects incoming bytes into '>'-delimited frames and hands each one to the request
+        that was in flight, then sends the next queued request.
+        """
+        buf = ''
+        while self._reading:
+            try:
+                chunk = self._connection.read(self._connection.inWaiting() or 1)
+            except Exception as e:
+                self._fail_all(e)
+                break
+
+            if not chunk:
+                # Read timed out; give up on the request in flight if the adapter has gone quiet for too long
+                in_flight = self._in_flight
+                if in_flight is not None and monotonic() - in_flight.sent_at > self.response_timeout:
+                    buf = ''
+                    try:
+                        self._resync()
+                    except Exception as e:
+                        self._fail_all(e)
+                        break
+                    self._complete(lambda future: future.set_exception(
+                        NoOBDDataException(future.command, None)))
+                continue
+
+            buf += chunk
+            while '>' in buf:
+                frame, buf = buf.split('>', 1)
+                # Only this thread clears _in_flight, so it can't change under us
+                in_flight = self._in_flight
+                if self.recorder is not None and in_flight is not None:
+                    self._record(in_flight, frame + '>')
+                self._complete(lambda future: future.set_response(frame + '>'))
+
+    def _resync(self):
+        """
+        Brings the adapter back to its prompt after a request timed out, so a late answer to it can't be taken for the
+        next request's. A carriage return stops an answer in progress (the adapter says STOPPED) or, if it was idle,
+        repeats the last command; either way a prompt follows. The timed-out request is still in flight meanwhile, so
+        nothing else is written.
+        """
+        self._connection.write('\r')
+        self._read_until('>')
+        self._connection.flushInput()
+
+    def _record(self, future, response):
+        # A recorder that fails mustn't take the reader thread down with it; see GPSSource._publish
+        try:
+            self.recorder.obd(future.command, response, monotonic() - future.sent_at)
+        except Exception as e:
+            log.debug('OBD recorder: {0}, no longer recording responses'.format(e))
+            log.debug(traceback.format_exc())
+            self.recorder = None
+
+    def _complete(self, resolve):
+        """
+        Resolves the request in flight with resolve(future) and writes the next pending request to the adapter
+        """
+        with self._lock:
+            future = self._in_flight
+            self._in_flight = None
+            if self._pending:
+                self._write(self._pending.popleft())
+        if future is not None:
+            resolve(future)
+
+    def _fail_all(self, exception):
+        with self._lock:
+            futures = list(self._pending)
+            if self._in_flight is not None:
+                futures.append(self._in_flight)
+            self._pending.clear()
+            self._in_flight = None
+        for future in futures:
+            future.set_exception(exception)
+
+    def _write(self, future):
+        """
+        Sends future's command. Must be called with _lock held.
+        """
+        self._in_flight = future
+        future.sent_at = monotonic()
+        self._connection.write(future.command + '\r')
+
+    def _submit(self, command, parser):
+        """
+        Queues command for the adapter, returns an OBDFuture that resolves to parser(response)
+        """
+        future = OBDFuture(command, parser)
+        with self._lock:
+            if self._in_flight is None:
+                self._write(future)
+            else:
+                self._pending.append(future)
+        return future
+
+    def check_trouble(self):
+        """
+        Queues a mode 03 request for stored trouble codes.
+        Returns an OBDFuture whose result is a list of codes like 'P0133'
+        """
+        if self._debug:
+            future = OBDFuture('03', None)
+            future.sent_at = monotonic()
+            future.set_result([])
+            return future
+
+        return self._submit('03', self.split_trouble_codes)
+
+    @staticmethod
+    def split_trouble_codes(response):
+        """
+        Decodes a mode 03 response, e.g. '03\r43 01 33 00 00 00 00 \r\r>' returns ['P0133']
+        """
+        codes = []
+        for line in response.replace('>', '').split('\r'):
+            line = line.replace(' ', '')
+            if not line.startswith('43'):
+                # Blank line, command echo or 'NO DATA'
+                continue
+            line = line[2:]
+            if len(line) % 4:
+                # CAN adapters put the number of codes before the codes themselves
+                line = line[2:]
+            for i in xrange(0, len(line) - 3, 4):
+                code = line[i:i + 4]
+                if code == '0000':
+                    continue
+                first = int(code[0], 16)
+                codes.append('PCBU'[first >> 2] + str(first & 0x03) + code[1:])
+
+        return codes
 
     def get_pid_data(self, pid):
         """
         Enter mode and hex PID (e.g. '010D' for current speed data)
-        Returns response in decimal
+        Returns the data bytes of the response as a bytearray
         """
 
         pid = pid.replace(' ', '')  # Can't have spaces.
 
         if self._debug:
-            return 10
+            return self._debug_data(pid)
+
+        return self.get_pids([pid])[pid]
+
+    def get_pids(self, pids):
+        """
+        Requests several mode 01 PIDs (e.g. ['010D', '0110']) in as few round-trips as possible, packing up to MAX_PIDS
+        into each request.
+        Returns a dict of PID: bytearray holding that PID's data bytes
+        """
+        pids = [pid.replace(' ', '') for pid in pids]
+
+        if self._debug:
+            return dict((pid, self._debug_data(pid)) for pid in pids)
+
+        # Queue every batch before waiting on any of them so the adapter never sits idle between batches
+        futures = [self.request(pids[i:i + self.MAX_PIDS]) for i in xrange(0, len(pids), self.MAX_PIDS)]
+        data = {}
+        for future in futures:
+            data.update(future.result(self.response_timeout * len(futures)))
+
+        return data
+
+    def request(self, pids):
+        """
+        Queues a request for up to MAX_PIDS mode 01 PIDs without waiting for the answer.
+        Returns an OBDFuture whose result is the same dict of PID: bytearray that get_pids returns.
+        """
+        pids = [pid.replace(' ', '') for pid in pids]
+        if len(pids) > self.MAX_PIDS:
+            raise ValueError('At most {0} PIDs can be requested at once'.format(self.MAX_PIDS))
+
+        command = '01' + ''.join(pid[2:] for pid in pids)
+
+        if self._debug:
+            future = OBDFuture(command, None)
+            future.sent_at = monotonic()
+            future.set_result(dict((pid, self._debug_data(pid)) for pid in pids))
+            return future
 
-        self._connection.write(pid + '1\r')
         # Adding the "1" after the command should force a wait for only one response from the CAN bus
+        return self._submit(command + '1', lambda response: self.split_response(command, response))
+
+    @staticmethod
+    def _debug_data(pid):
+        return bytearray([10] * PID_LENGTHS.get(pid, 1))
+
+    @staticmethod
+    def split_response(command, response):
+        """
+        Splits a mode 01 response into per-PID bytearrays.
+        e.g. split_response('010D10', '010D101\r41 0D 00 10 01 7B \r\r>') returns
+        {'010D': bytearray(b'\x00'), '0110': bytearray(b'\x01\x7b')}
+        """
+        replies = []
+        remaining = None
+        for line in response.replace('>', '').split('\r'):
+            line = line.strip()
+            if not line or line.replace(' ', '').startswith(command) or line.startswith('SEARCHING'):
+                # Blank line, command echo or protocol search notice
+                continue
+            if ':' in line:
+                # Numbered frame of a multi-frame response, e.g. '0: 41 0D 00 10 01 7B'
+                frame, line = line.split(':', 1)
+                if frame.strip() == '0' or not replies:
+                    replies.append(bytearray())
+            elif len(line) <= 3 and all(c in hexdigits for c in line):
+                # Byte count header that precedes a multi-frame response
+                remaining = int(line, 16)
+                continue
+            else:
+                replies.append(bytearray())
+            try:
+                replies[-1].extend(bytearray.fromhex(line.replace(' ', '')))
+            except ValueError:
+                # 'NO DATA', 'UNABLE TO CONNECT', '?' and the like
+                raise NoOBDDataException(command, response)
+
+        data = {}
+        for reply in replies:
+            if remaining is not None:
+                # Frames are padded out to a fixed length, so drop anything past the advertised byte count
+                reply = reply[:remaining]
+            if not reply or reply[0] != 0x41:
+                # Not a mode 01 reply, so the bus gave us nothing usable
+                raise NoOBDDataException(command, response)
+            i = 1
+            while i < len(reply):
+                pid = '01{0:02X}'.format(reply[i])
+                try:
+                    length = PID_LENGTHS[pid]
+                except KeyError:
+                    raise NoOBDDataException(command, response)
+                if i + 1 + length > len(reply):
+                    # Reply was cut short
+                    raise NoOBDDataException(command, response)
+                data[pid] = reply[i + 1:i + 1 + length]
+                i += 1 + length
 
-        response = self._connection.readline().split(' ')
-        # response.split is ['010D101\r41', '0D', '00', '10', '00', 'BD', '\r\r>']
+        requested = [command[j:j + 2] for j in xrange(2, len(command), 2)]
+        if not data or any('01' + pid not in data for pid in requested):
+            raise NoOBDDataException(command, response)
 
-        return response[2: -1]
+        return data
 
     @property
     def is_connected(self):
@@ -80,15 +553,25 @@ class OBDController():
     @property
     def maf(self):
         pid = '0110'
-        data = self.get_pid_data('0110')
+        data = self.get_pid_data(pid)
         return decode_obd_data(pid, data)
 
     def disconnect(self):
         """
-        Closes connection
+        Resets the adapter and closes connection. The adapter stays powered from the OBD port with the ignition off, so
+        without the reset it would keep tune()'s settings and baud rate into the next run.
         """
         if self._debug:
             return "Disconnected"
 
+        self._reading = False
+        if self._reader is not None:
+            self._reader.join(timeout=1)
+        self._fail_all(NoOBDDataException(None, 'Disconnected'))
+        try:
+            # Back to DEFAULT_BAUDRATE and the default settings
+            self._transact('ATZ')
+        except Exception as e:
+            log.debug('OBD reset failed: {0}'.format(e))
         self._connection.close()
         return "Disconnected"
@@ -1,29 +1,158 @@
 import os
 from oled.device import ssd1306
-from oled.render import canvas
-from PIL import ImageFont, ImageDraw
+from PIL import Image, ImageFont, ImageDraw
 from pytweening import easeOutQuad, easeInQuad
 from threading import Thread
+from RenderCache import RenderCache
+from Clock import monotonic
 
 
 class OLEDController(object):
 
-    def __init__(self):
+    # Characters cached one by one, so strings of them (numbers, mostly) are pasted together without FreeType
+    GLYPHS = '0123456789.-: '
 
-        self.device = ssd1306(port=1, address=0x3C)
+    # Dashboard rows, top to bottom: the value drawn in each, its label and how it's formatted
+    FIELDS = [('minutes_per_gallon', 'MIN/GAL', '{0:.1f}'),
+              ('trip_avg', 'TRIP MPG', '{0:.1f}'),
+              ('track', 'HEADING', '{0}')]
+
+    def __init__(self, max_fps=None, device=None):
+        """
+        If max_fps is given, the dashboard is redrawn at most that many times a second however often print_dashboard
+        is called. Carputer leaves it unset and paces frames with its DisplayService instead.
+        device defaults to the SSD1306 on I2C bus 1; pass e.g. an oled.device.dummy to run without one.
+        """
+
+        # Whole frames in one write; the display is the only thing on its bus
+        self.device = device if device is not None else ssd1306(port=1, address=0x3C, raw=True)
         self.font = ImageFont.truetype(os.path.join(os.path.dirname(
             os.path.abspath(__file__)), 'oled/font/OpenSans.ttf'), 14)
         self.width = self.device.width
         self.height = self.device.height
+        # Text bitmaps, and frames packed for the device, keyed by what's drawn in them
+        self.text_cache = RenderCache(256)
+        self.frame_cache = RenderCache(64)
+        # Every bitmap is this tall, so pasted-together glyphs line up
+        self.line_height = self.font.getsize(self.GLYPHS + 'Agjy')[1]
+
+        self.max_fps = max_fps
+        self.row_height = self.height / len(self.FIELDS)
+        # Values are right-aligned in the columns right of the widest label
+        self.value_x = max(self.font.getsize(label)[0] for _, label, _ in self.FIELDS) + 4
+        # The dashboard as last drawn, the text drawn in each field, and whether it's what the screen is showing
+        self.dashboard = None
+        self.drawn = {}
+        self.showing_dashboard = False
+        self.last_frame = None
         # Clear the screen, as it sometimes draws some artifacts when initialized
         self.clear()
 
     def clear(self):
-        with canvas(self.device) as draw:
-            draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
+        self.device.show(self.frame_cache.get('clear', lambda: self.device.pack_frame(self.blank())))
+        self.showing_dashboard = False
+
+    def blank(self):
+        return Image.new('1', (self.width, self.height))
+
+    def text_image(self, text):
+        """
+        Returns a 1-bit bitmap of text in self.font, from the cache if it's been drawn before
+        """
+        def render():
+            if len(text) > 1 and all(c in self.GLYPHS for c in text):
+                glyphs = [self.text_image(c) for c in text]
+                image = Image.new('1', (sum(glyph.size[0] for glyph in glyphs), self.line_height))
+                x = 0
+                for glyph in glyphs:
+                    image.paste(glyph, (x, 0))
+                    x += glyph.size[0]
+                return image
+            image = Image.new('1', (self.font.getsize(text)[0], self.line_height))
+            ImageDraw.Draw(image).text((0, 0), text, font=self.font, fill=255)
+            return image
+
+        return self.text_cache.get(text, render)
+
+    def wrap(self, message):
+        """
+        Splits message into lines that fit across the screen, breaking at spaces where it can and inside words too long
+        for a line of their own. Line breaks already in message are kept.
+        """
+        def fits(text):
+            return self.font.getsize(text)[0] <= self.width
+
+        lines = []
+        for paragraph in message.split('\n'):
+            line = ''
+            for word in paragraph.split():
+                candidate = line + ' ' + word if line else word
+                if fits(candidate):
+                    line = candidate
+                    continue
+                if line:
+                    lines.append(line)
+                while not fits(word):
+                    end = len(word) - 1
+                    while end > 1 and not fits(word[:end]):
+                        end -= 1
+                    lines.append(word[:end])
+                    word = word[end:]
+                line = word
+            lines.append(line)
+        return lines
 
     def print_message(self, message):
-        raise NotImplementedError("OLEDController.print_message is not complete yet")
+        """
+        Shows message, wrapped to the screen's width and centred line by line, in place of whatever is on the screen.
+        Lines past the bottom of the screen are left off.
+        """
+        def render():
+            image = self.blank()
+            lines = self.wrap(message)[:self.height / self.line_height]
+            top = (self.height - len(lines) * self.line_height) / 2
+            for i, line in enumerate(lines):
+                if line:
+                    text = self.text_image(line)
+                    image.paste(text, ((self.width - text.size[0]) / 2, top + i * self.line_height))
+            return self.device.pack_frame(image)
+
+        self.device.show(self.frame_cache.get(('message', message), render))
+        self.showing_dashboard = False
+
+    def print_dashboard(self, trip_avg, minutes_per_gallon, track):
+        """
+        Shows the driving dashboard. Fields are only redrawn when their text changes, and then only the columns that
+        changed are sent to the device. Calls less than 1 / max_fps seconds after the last frame are ignored.
+        Returns whether a frame was drawn.
+        """
+        now = monotonic()
+        if self.max_fps and self.last_frame is not None and now - self.last_frame < 1.0 / self.max_fps:
+            return False
+        self.last_frame = now
+
+        if self.dashboard is None:
+            self.dashboard = self.blank()
+            for row, (_, label, _) in enumerate(self.FIELDS):
+                self.dashboard.paste(self.text_image(label), (0, row * self.row_height))
+
+        values = {'trip_avg': trip_avg, 'minutes_per_gallon': minutes_per_gallon, 'track': track}
+        changed = False
+        for row, (field, _, fmt) in enumerate(self.FIELDS):
+            value = fmt.format(values[field])
+            if self.drawn.get(field) == value:
+                continue
+            top = row * self.row_height
+            self.dashboard.paste(0, (self.value_x, top, self.width, top + self.line_height))
+            text = self.text_image(value)
+            self.dashboard.paste(text, (self.width - text.size[0], top))
+            self.drawn[field] = value
+            changed = True
+
+        if changed or not self.showing_dashboard:
+            self.device.show(self.device.pack_frame(self.dashboard))
+            self.showing_dashboard = True
+        return True
 
     def run_load_animation(self, message_queue, complete_token):
         """Plays spin animation and prints loading message during carputer startup
@@ -36,6 +165,15 @@ class OLEDController(object):
         out_animation = easeOutQuad
         in_animation = easeInQuad
 
+        def render_frame(message, start, stop):
+            """Packs a frame showing an arc from start to stop degrees with message underneath"""
+            image = self.blank()
+            text = self.text_image(message)
+            image.paste(text, ((self.width / 2) - (text.size[0] / 2), (3 * self.height / 4) - (text.size[1] / 2)))
+            ImageDraw.Draw(image).arc(((self.width / 2) - (self.height / 4), 0, (self.width / 2) + (self.height / 4),
+                                       self.height / 2), start, stop, fill=255)
+            return self.device.pack_frame(image)
+
         def draw_frame(animation, message, i, counterclockwise=False):
             """Draws a single frame of the loading spin animation with message underneath"""
             if counterclockwise:
@@ -44,12 +182,9 @@ class OLEDController(object):
             else:
                 stop = max(int(animation(i / 360.0) * 360), 1)
                 start = 0
-            font_size = self.font.getsize(message)
-            with canvas(self.device) as draw:
-                draw.text(((self.width / 2) - (font_size[0] / 2), (3 * self.height / 4) - (font_size[1] / 2)), message,
-                          font=self.font, fill=255)
-                draw.arc(((self.width / 2) - (self.height / 4), 0, (self.width / 2) + (self.height / 4),
-                          self.height / 2), start, stop, fill=255)
+            # The spinner goes through the same few angles every turn, so after the first turn this is a lookup
+            self.device.show(self.frame_cache.get(('spinner', message, start, stop),
+                                                  lambda: render_frame(message, start, stop)))
 
         def loop(queue, token):
             status = queue.get()
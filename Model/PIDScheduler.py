@@ -0,0 +1,112 @@
+from threading import Lock
+from Clock import monotonic
+
+
+class PIDScheduler(object):
+    """
+    Decides which PIDs go into each OBD request so the serial link's bandwidth goes where it matters.
+
+    Every PID has a target rate in Hz. PIDs with a rate of None are sent with every request; these are the fast-changing
+    signals the MPG math relies on. The remaining slots are shared round-robin among the slower PIDs that are due,
+    most overdue (in periods) first. A rate of 0 means once per drive. Trouble codes ('03') can't share a mode 01
+    request, so they are queued as a request of their own.
+    """
+
+    TROUBLE_CODES = '03'
+
+    DEFAULT_RATES = {
+        '010D': None,        # Speed
+        '0110': None,        # Mass air flow
+        '0105': 0.2,         # Coolant temperature
+        '012F': 0.2,         # Fuel level
+        TROUBLE_CODES: 0
+    }
+
+    def __init__(self, obdcontroller, rates=None):
+        self.obd = obdcontroller
+        self.rates = dict(self.DEFAULT_RATES if rates is None else rates)
+        self.latest = {}
+        self._lock = Lock()
+        self._fast = sorted(pid for pid, rate in self.rates.items() if rate is None)
+        # None until a PID is first sent, which it is in the first request with room for it
+        self._next_due = dict((pid, None) for pid, rate in self.rates.items() if rate is not None)
+        self._counts = dict((pid, 0) for pid in self.rates)
+        self._started = None
+
+    def next_batch(self, now):
+        """
+        Picks the mode 01 PIDs for the next request and reschedules the slow ones that made it in
+        """
+        batch = list(self._fast)
+        due = [pid for pid, next_due in self._next_due.items()
+               if pid != self.TROUBLE_CODES and (next_due is None or next_due <= now)]
+        # How many periods each PID is behind; a PID that wants 1 Hz and is a second late ranks with one that wants
+        # 0.1 Hz and is ten seconds late
+        due.sort(key=lambda pid: self._lag(pid, now), reverse=True)
+
+        for pid in due[:max(self.obd.MAX_PIDS - len(batch), 0)]:
+            batch.append(pid)
+            rate = self.rates[pid]
+            if rate:
+                next_due = self._next_due[pid]
+                if next_due is None or next_due + 1.0 / rate <= now:
+                    # First send, or a whole period behind: start over from now rather than burst to catch up
+                    self._next_due[pid] = now + 1.0 / rate
+                else:
+                    self._next_due[pid] = next_due + 1.0 / rate
+            else:
+                del self._next_due[pid]
+
+        return batch
+
+    def _lag(self, pid, now):
+        next_due = self._next_due[pid]
+        return 0.0 if next_due is None else (now - next_due) * (self.rates[pid] or 1.0)
+
+    def request(self, now=None):
+        """
+        Queues the next batch of PIDs with the OBD controller, returns the OBDFuture for it.
+        Once answered, the values also end up in latest and count towards the achieved rates.
+        now is the monotonic() time, if the caller has it already.
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            if self._started is None:
+                self._started = now
+            trouble_due = self.TROUBLE_CODES in self._next_due
+            if trouble_due:
+                del self._next_due[self.TROUBLE_CODES]
+            batch = self.next_batch(now)
+
+        # Callbacks run straight away on futures that are already answered, so they're added without the lock held
+        if trouble_due:
+            self.obd.check_trouble().add_done_callback(self._record)
+        future = self.obd.request(batch)
+        future.add_done_callback(self._record)
+        return future
+
+    def _record(self, future):
+        try:
+            result = future.result(0)
+        except Exception:
+            return
+
+        with self._lock:
+            if future.command == self.TROUBLE_CODES:
+                result = {self.TROUBLE_CODES: result}
+            for pid, value in result.items():
+                self.latest[pid] = value
+                self._counts[pid] = self._counts.get(pid, 0) + 1
+
+    def achieved_rates(self, now=None):
+        """
+        Returns a dict of PID: answers received per second from the first request until now (monotonic() if not given)
+        """
+        if now is None:
+            now = monotonic()
+        with self._lock:
+            if self._started is None:
+                return dict((pid, 0.0) for pid in self._counts)
+            elapsed = max(now - self._started, 1e-6)
+            return dict((pid, count / elapsed) for pid, count in self._counts.items())
@@ -0,0 +1,73 @@
+import logging
+import traceback
+from threading import Thread
+from Queue import Queue, Full, Empty
+
+
+class Stage(object):
+    """
+    One step of the data pipeline: a worker thread that feeds each item from a bounded queue to handler.
+
+    policy decides what put() does when the queue is full:
+    BLOCK waits for room, DROP_OLDEST throws away the oldest queued item to make room, and DROP_NEWEST throws away
+    the item being put. Carputer's storage stage blocks by default; the drop policies trade rows for never holding up
+    the loop thread.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    def __init__(self, name, handler, maxsize=1, policy=BLOCK):
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.queue = Queue(maxsize)
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    def put(self, item):
+        if self.policy == self.BLOCK:
+            self.queue.put(item)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Full:
+                self.dropped += 1
+                if self.policy == self.DROP_NEWEST:
+                    return
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                pass
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """
+        Lets the stage work through whatever is still queued, then waits up to timeout seconds for it to finish
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while self.running or not self.queue.empty():
+            try:
+                item = self.queue.get(timeout=.1)
+            except Empty:
+                continue
+
+            try:
+                self.handler(item)
+            except Exception as e:
+                logging.debug('{0} stage: {1}'.format(self.name, e))
+                logging.debug(traceback.format_exc())
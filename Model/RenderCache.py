@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+
+class RenderCache(object):
+    """
+    Least-recently-used cache of rendered things (text bitmaps, packed frames), keyed by whatever determines their
+    content. Holds at most capacity items; adding one more drops the one used longest ago.
+    """
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key, render):
+        """
+        Returns the item cached under key, or calls render() to make it and caches that
+        """
+        try:
+            item = self._items.pop(key)
+            self.hits += 1
+        except KeyError:
+            item = render()
+            self.misses += 1
+            if len(self._items) >= self.capacity:
+                self._items.popitem(last=False)
+        # Re-inserting moves it to the most recently used end
+        self._items[key] = item
+        return item
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
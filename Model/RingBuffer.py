@@ -0,0 +1,76 @@
+from array import array
+
+
+class RingBuffer(object):
+    """
+    Fixed-size, array-backed buffer of the most recent samples, with running sums for a few trailing time windows.
+    Adding a sample and reading a window's figures are both constant time, and memory stays the same however long
+    the drive lasts. Capacity defaults to the longest window at rate samples a second; if samples come faster than
+    that, older ones are dropped from every window once their slot is overwritten and the windows cover less time.
+    """
+
+    # Fields kept for every sample, in the order add() takes them after the time
+    FIELDS = ['MPG', 'SPD', 'DIST', 'FUEL']
+
+    def __init__(self, windows=(10, 60, 300), rate=40, capacity=None):
+        self.windows = list(windows)
+        self.capacity = capacity or int(max(self.windows) * rate)
+        self._times = array('d', [0.0]) * self.capacity
+        self._columns = [array('d', [0.0]) * self.capacity for _ in self.FIELDS]
+        # Samples ever added; the next one goes in slot _count % capacity
+        self._count = 0
+        # For each window, the absolute index of its oldest sample and the sums of each field over it
+        self._starts = [0] * len(self.windows)
+        self._sums = [[0.0] * len(self.FIELDS) for _ in self.windows]
+
+    def add(self, time, mpg, speed, distance, fuel):
+        """
+        Adds a sample taken at time (seconds) and drops samples that have aged out of each window
+        """
+        slot = self._count % self.capacity
+        values = (mpg, speed, distance, fuel)
+
+        # The slot about to be overwritten leaves every window still holding it
+        for w in xrange(len(self.windows)):
+            if self._count - self._starts[w] == self.capacity:
+                self._evict(w)
+
+        self._times[slot] = time
+        for column, value in zip(self._columns, values):
+            column[slot] = value
+        self._count += 1
+
+        for w, window in enumerate(self.windows):
+            sums = self._sums[w]
+            for f, value in enumerate(values):
+                sums[f] += value
+            while self._times[self._starts[w] % self.capacity] <= time - window:
+                self._evict(w)
+
+    def _evict(self, w):
+        """
+        Drops window w's oldest sample
+        """
+        old = self._starts[w] % self.capacity
+        sums = self._sums[w]
+        for f, column in enumerate(self._columns):
+            sums[f] -= column[old]
+        self._starts[w] += 1
+        if self._starts[w] == self._count:
+            # Nothing left in the window; start the sums over so rounding error can't build up
+            sums[:] = [0.0] * len(self.FIELDS)
+
+    def window(self, seconds):
+        """
+        Returns figures for the trailing window of the given length (one of windows) as a dict:
+        N samples, average instantaneous MPG and SPD, total DIST and FUEL, and AVG_MPG, which is DIST / FUEL
+        """
+        w = self.windows.index(seconds)
+        n = self._count - self._starts[w]
+        mpg, speed, distance, fuel = self._sums[w]
+        return {'N': n,
+                'MPG': mpg / n if n else 0.0,
+                'SPD': speed / n if n else 0.0,
+                'DIST': distance,
+                'FUEL': fuel,
+                'AVG_MPG': distance / fuel if fuel else 0.0}
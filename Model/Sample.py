@@ -0,0 +1,24 @@
+class Sample(object):
+    """
+    One tick's worth of data, passed as-is from collection through processing, display and storage.
+    __slots__ keeps it to a fixed handful of numbers rather than a per-tick dict.
+    """
+
+    __slots__ = ('timestamp', 'mpg', 'speed', 'lat', 'lon', 'track', 'tick', 'distance', 'fuel')
+
+    def __init__(self, timestamp, mpg, speed, lat, lon, track, tick, distance=0.0, fuel=0.0):
+        # UTC milliseconds
+        self.timestamp = timestamp
+        self.mpg = mpg
+        self.speed = speed
+        self.lat = lat
+        self.lon = lon
+        self.track = track
+        # Seconds since the previous sample
+        self.tick = tick
+        # Distance covered and fuel used over the tick, filled in by Carputer.process_data
+        self.distance = distance
+        self.fuel = fuel
+
+    def __repr__(self):
+        return 'Sample({0})'.format(', '.join('{0}={1!r}'.format(name, getattr(self, name)) for name in self.__slots__))
@@ -0,0 +1,159 @@
+########################################################################################################################
+# Stand-ins for the car's hardware, so the whole loop can run on a laptop:                                             #
+# ELM327Simulator takes the place of the adapter's serial port, ScriptedGPS replays a made-up drive as GPS fixes and   #
+# oled.device.dummy (see OLEDController's device argument) keeps frames in memory instead of sending them over I2C.    #
+########################################################################################################################
+
+import math
+import random
+from threading import Condition
+from time import sleep
+from Clock import GPSClock, monotonic
+from DecodeFunctions import PID_LENGTHS
+from GPSSource import GPSSource, GPSFix, MODE_NO_FIX, MODE_3D
+
+
+def default_obd_script(t):
+    """
+    Raw data bytes for PIDs at t seconds into the drive: speed swinging between 20 and 100 km/h every couple of
+    minutes, and a MAF that roughly follows it
+    """
+    speed = 60 + 40 * math.sin(t / 20.0)
+    maf = int((2 + speed * 0.08) * 100)
+    return {'010D': [int(speed)],
+            '0110': [maf >> 8, maf & 0xFF]}
+
+
+class ELM327Simulator(object):
+    """
+    Pretends to be an ELM327 on a serial port; pass one to OBDController as its connection. Answers AT commands and
+    mode 01 and 03 requests. Each answer takes latency seconds plus the per_pid latency of every PID asked for, give or
+    take up to jitter seconds. Jitter comes from a generator seeded with seed, so a run's latencies are repeatable.
+    script(t) returns {PID: data bytes} for t seconds after the simulator was made; PIDs it leaves out read as zeros.
+    """
+
+    def __init__(self, script=default_obd_script, latency=0.03, per_pid=None, jitter=0.005, seed=0, timeout=0.1):
+        self.script = script
+        self.latency = latency
+        self.per_pid = per_pid or {}
+        self.jitter = jitter
+        self.timeout = timeout
+        self.baudrate = 38400
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._echo = True
+        self._spaces = True
+        self._started = monotonic()
+        # Response waiting to be read, and when it's ready
+        self._out = ''
+        self._ready_at = 0.0
+        self._condition = Condition()
+
+    def write(self, data):
+        command = data.strip().upper()
+        response = self.answer(command)
+        delay = 0.0
+        if command.startswith('0'):
+            self.requests += 1
+            pids = [command[i:i + 2] for i in xrange(2, len(command) - len(command) % 2, 2)]
+            delay = self.latency + sum(self.per_pid.get('01' + pid, 0.0) for pid in pids)
+            delay = max(delay + self._random.uniform(-self.jitter, self.jitter), 0.0)
+
+        with self._condition:
+            self._out += (command + '\r' if self._echo else '') + response + '\r\r>'
+            self._ready_at = monotonic() + delay
+            self._condition.notify_all()
+
+    def answer(self, command):
+        """
+        The adapter's reply to command, without the echo and prompt
+        """
+        if command.startswith('AT'):
+            if command == 'ATI' or command == 'ATZ':
+                return 'ELM327 v1.5'
+            if command.startswith('ATBRD'):
+                # Stay at one baud rate; the real adapter's answer to a rate it can't do
+                return '?'
+            if command in ('ATE0', 'ATE1'):
+                self._echo = command == 'ATE1'
+            elif command in ('ATS0', 'ATS1'):
+                self._spaces = command == 'ATS1'
+            return 'OK'
+
+        if command == '03':
+            return self._bytes([0x43, 0, 0, 0, 0, 0, 0])
+
+        if command.startswith('01'):
+            data = self.script(monotonic() - self._started)
+            # A trailing odd digit is the number of responses to wait for
+            pids = ['01' + command[i:i + 2] for i in xrange(2, len(command) - len(command) % 2, 2)]
+            if any(pid not in PID_LENGTHS for pid in pids):
+                return 'NO DATA'
+            reply = [0x41]
+            for pid in pids:
+                reply.append(int(pid[2:], 16))
+                reply.extend(data.get(pid, [0] * PID_LENGTHS[pid]))
+            return self._bytes(reply)
+
+        return '?'
+
+    def _bytes(self, values):
+        return (' ' if self._spaces else '').join('{0:02X}'.format(value) for value in values)
+
+    def inWaiting(self):
+        with self._condition:
+            return len(self._out) if monotonic() >= self._ready_at else 0
+
+    def read(self, size=1):
+        with self._condition:
+            deadline = monotonic() + self.timeout
+            while True:
+                now = monotonic()
+                if self._out and now >= self._ready_at:
+                    data, self._out = self._out[:size], self._out[size:]
+                    return data
+                if now >= deadline:
+                    return ''
+                wait = deadline if not self._out else min(deadline, self._ready_at)
+                self._condition.wait(wait - now)
+
+    def flushInput(self):
+        with self._condition:
+            self._out = ''
+
+    def close(self):
+        pass
+
+
+def default_gps_script(t):
+    """
+    Position, track and speed (m/s) t seconds into the drive: heading east from Seattle at 20 m/s
+    """
+    # About 111 km to a degree of latitude, fewer per degree of longitude this far north
+    return 47.6, -122.3 + t * 20 / (111000 * math.cos(math.radians(47.6))), 90.0, 20.0
+
+
+class ScriptedGPS(GPSSource):
+    """
+    GPS source that publishes fixes from script(t), which returns (latitude, longitude, track, speed) for t seconds
+    after start(), rate times a second. The first fix_delay seconds of reports have no fix. UTC time starts at start_utc
+    (epoch seconds).
+    """
+
+    def __init__(self, script=default_gps_script, rate=5, fix_delay=0.0, start_utc=1451861510.0):
+        super(ScriptedGPS, self).__init__()
+        self.script = script
+        self.rate = rate
+        self.fix_delay = fix_delay
+        self.start_utc = start_utc
+
+    def update(self):
+        started = monotonic()
+        while self.running:
+            received = monotonic()
+            t = received - started
+            latitude, longitude, track, speed = self.script(t)
+            mode = MODE_3D if t >= self.fix_delay else MODE_NO_FIX
+            self._publish(GPSFix(mode, GPSClock.format_utc(self.start_utc + t), latitude, longitude, track, speed,
+                                 received))
+            sleep(max(1.0 / self.rate - (monotonic() - received), 0))
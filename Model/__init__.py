@@ -1,5 +1,6 @@
 from Carputer import Carputer
 from DriveDatabase import DriveDatabase
 from GPSController import GPSController
+from NMEAGPSController import NMEAGPSController
 from OBDController import OBDController
 from OLEDController import OLEDController
\ No newline at end of file
@@ -50,19 +50,95 @@
 # As before, as soon as the with block completes, the canvas buffer is flushed
 # to the device
 
+import fcntl
+import os
 import smbus
+import struct
+from PIL import Image
+
+# ioctl that sets the slave address later reads and writes on an i2c-dev
+# file descriptor go to (linux/i2c-dev.h)
+I2C_SLAVE = 0x0703
+
+
+def pack(image, method):
+    """
+    Packs a 1-bit image into the displays' layout of one byte per column per
+    8-row page, top pixel in the low bit. After a quarter turn by method, each
+    image row is a display column, and tobytes() packs it most significant bit
+    first into one byte per page, bottom page first. So byte p of each column
+    is page (pages - 1 - p).
+    """
+    return bytearray(image.transpose(method).tobytes())
+
+
+def changed(old, new):
+    """
+    Returns the first and last index at which two equal-length byte strings
+    differ, or None if they're the same.
+    """
+    if old == new:
+        return None
+    start = 0
+    while old[start] == new[start]:
+        start += 1
+    end = len(new) - 1
+    while old[end] == new[end]:
+        end -= 1
+    return start, end
+
+
+def bus_clock(port):
+    """
+    Returns the I2C bus clock in Hz, as the kernel reports it, or None if it
+    can't be found. On the Pi it is set with dtparam=i2c_arm_baudrate in
+    /boot/config.txt and can't be changed at runtime.
+    """
+    try:
+        with open('/sys/class/i2c-adapter/i2c-{0}/of_node/clock-frequency'.format(port), 'rb') as f:
+            # A device tree cell: one big-endian 32-bit int
+            return struct.unpack('>I', f.read(4))[0]
+    except (IOError, OSError, struct.error):
+        return None
+
+
+class i2c(object):
+    """
+    Writes to one device through the bus's /dev/i2c-N file descriptor. Unlike
+    SMBus block writes, which carry at most 32 bytes, a write can be a whole
+    frame in a single bus transaction.
+    """
+
+    def __init__(self, port, address):
+        self.fd = os.open('/dev/i2c-{0}'.format(port), os.O_RDWR)
+        fcntl.ioctl(self.fd, I2C_SLAVE, address)
+
+    def write(self, control, data):
+        os.write(self.fd, bytes(bytearray([control]) + bytearray(data)))
+
+    def close(self):
+        os.close(self.fd)
 
 
 class device(object):
     """
-    Base class for OLED driver classes
+    Base class for OLED driver classes. With raw=True, commands and data go
+    through the i2c-dev file descriptor in one write each instead of as
+    32 byte SMBus block writes.
     """
 
-    def __init__(self, port=1, address=0x3C, cmd_mode=0x00, data_mode=0x40):
+    def __init__(self, port=1, address=0x3C, cmd_mode=0x00, data_mode=0x40,
+                 raw=False):
         self.cmd_mode = cmd_mode
         self.data_mode = data_mode
-        self.bus = smbus.SMBus(port)
+        self.raw = i2c(port, address) if raw else None
+        self.bus = None if raw else smbus.SMBus(port)
         self.addr = address
+        # Kept for the caller to log: the display is usually set up before
+        # logging is, so logging it here would go nowhere
+        self.bus_clock = bus_clock(port)
+        # Pages last sent to the display, or None if we don't know what it shows
+        self.frame = None
 
     def command(self, *cmd):
         """
@@ -70,19 +146,81 @@ class device(object):
         device - maximum allowed is 32 bytes in one go.
         """
         assert(len(cmd) <= 32)
+        if self.raw is not None:
+            self.raw.write(self.cmd_mode, cmd)
+            return
         self.bus.write_i2c_block_data(self.addr, self.cmd_mode, list(cmd))
 
     def data(self, data):
         """
         Sends a data byte or sequence of data bytes through to the
         device - maximum allowed in one transaction is 32 bytes, so if
-        data is larger than this it is sent in chunks.
+        data is larger than this it is sent in chunks. Raw writes send it
+        all at once.
         """
+        if self.raw is not None:
+            self.raw.write(self.data_mode, data)
+            return
         for i in xrange(0, len(data), 32):
             self.bus.write_i2c_block_data(self.addr,
                                           self.data_mode,
                                           list(data[i:i+32]))
 
+    def display(self, image):
+        """
+        Takes a 1-bit image and dumps it to the display.
+        """
+        self.show(self.pack_frame(image))
+
+    def pack_frame(self, image):
+        """
+        Packs a 1-bit image into the list of page buffers show() takes.
+        """
+        assert(image.mode == '1')
+        assert(image.size[0] == self.width)
+        assert(image.size[1] == self.height)
+
+        buf = pack(image, self.rotation)
+        return [buf[self.pages - 1 - page::self.pages]
+                for page in xrange(self.pages)]
+
+    def show(self, pages):
+        """
+        Takes a packed frame and sends the display only what changed since the
+        last one: for each page, the run of columns from the first changed
+        byte to the last. Unchanged pages aren't sent at all.
+        """
+        for page, new in enumerate(pages):
+            if self.frame is None:
+                start, end = 0, self.width - 1
+            else:
+                window = changed(self.frame[page], new)
+                if window is None:
+                    continue
+                start, end = window
+            self.write(page, start, new[start:end + 1])
+
+        self.frame = pages
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+        else:
+            self.bus.close()
+
+    def invalidate(self):
+        """
+        Makes the next display() send the whole frame, e.g. after the display
+        has been reset or written to some other way.
+        """
+        self.frame = None
+
+    def write(self, page, column, data):
+        """
+        Writes data to page from column onwards.
+        """
+        raise NotImplementedError
+
 
 class sh1106(device):
     """
@@ -93,8 +231,8 @@ class sh1106(device):
     data() methods are discouraged.
     """
 
-    def __init__(self, port=1, address=0x3C):
-        super(sh1106, self).__init__(port, address)
+    def __init__(self, port=1, address=0x3C, raw=False):
+        super(sh1106, self).__init__(port, address, raw=raw)
         self.width = 128
         self.height = 64
         self.pages = self.height / 8
@@ -117,33 +255,16 @@ class sh1106(device):
             const.CHARGEPUMP,         0x14,
             const.DISPLAYON)
 
-    def display(self, image):
-        """
-        Takes a 1-bit image and dumps it to the SH1106 OLED display.
-        """
-        assert(image.mode == '1')
-        assert(image.size[0] == self.width)
-        assert(image.size[1] == self.height)
-
-        page = 0xB0
-        pix = list(image.getdata())
-        step = self.width * 8
-        for y in xrange(0, self.pages * step, step):
-
-            # move to given page, then reset the column address
-            self.command(page, 0x02, 0x10)
-            page += 1
-
-            buf = []
-            for x in xrange(self.width):
-                byte = 0
-                for n in xrange(0, step, self.width):
-                    byte |= (pix[x + y + n] & 0x01) << 8
-                    byte >>= 1
+    rotation = Image.ROTATE_270
 
-                buf.append(byte)
-
-            self.data(buf)
+    def write(self, page, column, data):
+        # The SH1106's RAM is 132 columns wide, centred on the 128 pixel panel
+        column += 2
+        # move to given page, then set the column address
+        self.command(0xB0 + page,
+                     const.SETLOWCOLUMN | (column & 0x0F),
+                     const.SETHIGHCOLUMN | (column >> 4))
+        self.data(data)
 
 
 class ssd1306(device):
@@ -154,8 +275,8 @@ class ssd1306(device):
     called to affect the brightness. Direct use of the command() and
     data() methods are discouraged.
     """
-    def __init__(self, port=1, address=0x3C):
-        super(ssd1306, self).__init__(port, address)
+    def __init__(self, port=1, address=0x3C, raw=False):
+        super(ssd1306, self).__init__(port, address, raw=raw)
         self.width = 128
         self.height = 64
         self.pages = self.height / 8
@@ -178,33 +299,45 @@ class ssd1306(device):
             const.NORMALDISPLAY,
             const.DISPLAYON)
 
-    def display(self, image):
-        """
-        Takes a 1-bit image and dumps it to the SSD1306 OLED display.
-        """
-        assert(image.mode == '1')
-        assert(image.size[0] == self.width)
-        assert(image.size[1] == self.height)
+    # This panel's columns are written right to left
+    rotation = Image.TRANSVERSE
 
+    def write(self, page, column, data):
         self.command(
-            const.COLUMNADDR, 0x00, self.width-1,  # Column start/end address
-            const.PAGEADDR,   0x00, self.pages-1)  # Page start/end address
-
-        pix = list(image.getdata())
-        step = self.width * 8
-        buf = []
-        for y in xrange(0, self.pages * step, step):
-            i = y + self.width-1
-            while i >= y:
-                byte = 0
-                for n in xrange(0, step, self.width):
-                    byte |= (pix[i + n] & 0x01) << 8
-                    byte >>= 1
-
-                buf.append(byte)
-                i -= 1
-
-        self.data(buf)
+            const.COLUMNADDR, column, column + len(data) - 1,  # Column start/end address
+            const.PAGEADDR,   page, page)                      # Page start/end address
+        self.data(data)
+
+
+class dummy(device):
+    """
+    Stands in for a display that isn't there: frames are packed and diffed
+    as usual, but writes are only counted, and the display's RAM is kept in
+    memory. Useful for testing and benchmarking without the hardware.
+    """
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.pages = self.height / 8
+        self.frame = None
+        self.bus_clock = None
+        self.raw = None
+        self.rotation = Image.ROTATE_270
+        self.ram = [bytearray(self.width) for _ in xrange(self.pages)]
+        self.writes = 0
+        self.bytes_written = 0
+
+    def command(self, *cmd):
+        pass
+
+    def write(self, page, column, data):
+        self.ram[page][column:column + len(data)] = data
+        self.writes += 1
+        self.bytes_written += len(data)
+
+    def close(self):
+        pass
 
 
 class const:
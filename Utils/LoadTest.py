@@ -0,0 +1,48 @@
+"""
+Runs the whole carputer loop against simulated hardware and reports how fast it went.
+Usage: python Utils/LoadTest.py [seconds] [OBD latency in seconds]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from time import sleep
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Model.Carputer import Carputer
+from Model.DriveDatabase import DriveDatabase
+from Model.OBDController import OBDController
+from Model.OLEDController import OLEDController
+from Model.Simulators import ELM327Simulator, ScriptedGPS
+from Model.oled.device import dummy
+
+
+def run(seconds=30.0, latency=0.03):
+    workdir = tempfile.mkdtemp()
+    try:
+        device = dummy()
+        db = DriveDatabase(os.path.join(workdir, 'drive_data.db'))
+        carputer = Carputer(OBDController(None, connection=ELM327Simulator(latency=latency, jitter=latency / 5)),
+                            ScriptedGPS(),
+                            OLEDController(device=device),
+                            db,
+                            log_dir=workdir)
+        carputer.start()
+        sleep(seconds)
+        carputer.stop()
+
+        samples = db.query('SELECT COUNT(*) FROM samples WHERE DRIVE_ID = {0}')[0]
+        db.close()
+        print('{0} samples in {1} s: {2:.1f} per second'.format(samples, seconds, samples / seconds))
+        print('Frames drawn: {0}, coalesced: {1}, I2C bytes: {2}'.format(
+            carputer.display.frames, carputer.display.coalesced, device.bytes_written))
+        print('Dropped samples: {0}'.format(carputer.storage.dropped))
+        print('Achieved PID rates: {0}'.format(carputer.scheduler.achieved_rates()))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    run(*[float(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,42 @@
+"""
+Replays a recorded drive log through the MPG math, a database and a simulated display as fast as they'll go.
+Usage: python Utils/Replay.py drive.drv [database path]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from Model.Carputer import Carputer
+from Model.DriveDatabase import DriveDatabase
+from Model.DriveLog import replay
+from Model.OLEDController import OLEDController
+from Model.oled.device import dummy
+
+
+def run(log, database=None):
+    workdir = tempfile.mkdtemp()
+    try:
+        device = dummy()
+        db = DriveDatabase(database or os.path.join(workdir, 'replay.db'))
+        carputer = Carputer(None, None, OLEDController(device=device), db)
+        started = time()
+        samples = replay(log, carputer)
+        db.close()
+        elapsed = time() - started
+
+        print('{0} samples, {1:.0f} s of driving, replayed in {2:.2f} s'.format(samples, carputer.trip_time, elapsed))
+        print('{0:.2f} miles, {1:.3f} gallons, trip average {2:.2f} MPG'.format(
+            carputer.total_distance, carputer.total_gal,
+            carputer.total_distance / carputer.total_gal if carputer.total_gal else 0.0))
+        print('I2C bytes: {0}'.format(device.bytes_written))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:3])
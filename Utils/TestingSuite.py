@@ -10,6 +10,7 @@ from DriveDatabase import DriveDatabase
 from GPSController import GPSController
 from Model.LCDController import LCDController
 from OBDController import OBDController
+from Sample import Sample
 
 
 def poll_obd(obdcontroller):
@@ -67,9 +68,9 @@ def get_track(degrees):
 
 def gen_timestamp():
     """
-    Generates a unique (let's hope!), whole-number, unix-time timestamp.
+    Generates a unique (let's hope!), whole-number, unix-time timestamp in milliseconds.
     """
-    return int(time() * 1e6)
+    return int(time() * 1000)
 
 
 def get_data(obd, gps):
@@ -81,9 +82,8 @@ def get_data(obd, gps):
     gps_data = poll_gps(gps)
     obd_data = poll_obd(obd)
 
-    return ({'TIMESTAMP': str(timestamp), 'MPG': str(obd_data['MPG']), 'SPD': str(obd_data['SPD']), 'LAT': str(gps_data['LAT']),
-             'LON': str(gps_data['LON']), 'TRA': str(gps_data['TRA'])})
-             # return strings as values so that we can join for DB commit
+    return Sample(timestamp, float(obd_data['MPG']), float(obd_data['SPD']), gps_data['LAT'], gps_data['LON'],
+                  float(gps_data['TRA']), 1.0)
 
 
 def main_loop():
@@ -132,7 +132,7 @@ def main_loop():
     # connect to DB and create a trip-specific table
     db = DriveDatabase('/home/pi/databases/test_database.db')
     sleep(3)  # it can take the gps unit a few seconds to re-set the system time
-    db.new_table()
+    db.new_drive(gen_timestamp())
 
     lcd.clear()
     lcd.print_message('DB initialized')
@@ -171,11 +171,12 @@ def main_loop():
             continue
 
         # calculate 10 second and trip MPG averages
-        total_mpg += float(data['MPG'])
+        total_mpg += data.mpg
         total_cycles += 1
         trip_avg = str(round(float(total_mpg)/total_cycles, 2))
         logging.debug('trip avg: ' + trip_avg)
-        short_avg = str(round(float(db.query('SELECT avg(MPG) FROM {0} ORDER BY TIMESTAMP DESC LIMIT 10')[0]), 2))
+        short_avg = str(round(float(db.query('SELECT sum(MPG_SUM) / sum(N) FROM (SELECT MPG_SUM, N FROM rollup_1s '
+                                                     'WHERE DRIVE_ID = {0} ORDER BY BUCKET DESC LIMIT 10)')[0]), 2))
         logging.debug('short avg: ' + short_avg)
 
         # create a properly-spaced string of averages to print to LCD
@@ -185,13 +186,13 @@ def main_loop():
 
         # calculate minutes to consume one gallon at current speed and mpg
         try:
-            minutes_per_gallon = str(round((float(data['SPD']) / 60) / (float(data['MPG'])), 2))
+            minutes_per_gallon = str(round((data.speed / 60) / data.mpg, 2))
 
         except ZeroDivisionError:
             minutes_per_gallon = '0'
 
         # get track as cardinal direction
-        degrees = float(data['TRA'])
+        degrees = data.track
         track = get_track(degrees)
 
         # create a message from track
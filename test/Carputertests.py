@@ -0,0 +1,50 @@
+from __future__ import absolute_import
+import os
+import shutil
+import sqlite3
+import tempfile
+from context import Model
+from Model.Carputer import Carputer
+from Model.DriveDatabase import DriveDatabase
+from Model.OLEDController import OLEDController
+from Model.Sample import Sample
+from Model.oled.device import dummy
+
+NAN = float('nan')
+
+
+def test_track():
+    assert Carputer.get_track(0.0) == 'N'
+    assert Carputer.get_track(90.0) == 'E'
+    assert Carputer.get_track(359.5) == 'N'
+    assert Carputer.get_track(NAN) == '--'
+
+
+def test_lost_fix_is_stored():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive_data.db')
+        db = DriveDatabase(path)
+        carputer = Carputer(None, None, OLEDController(device=dummy()), db)
+        db.new_drive(1451861510000)
+        # What run_loop does with a tick taken after gpsd lost the fix
+        sample = Sample(1451861510000, 30.0, 88.0, NAN, NAN, NAN, 0.2)
+        trip_avg, minutes_per_gallon, track = carputer.process_data(sample)
+        carputer.store(sample)
+        db.close()
+        assert track == '--'
+        assert abs(carputer.total_distance - 88.0 / 3600 * 0.2) < 1e-9
+
+        con = sqlite3.connect(path)
+        try:
+            assert con.execute('SELECT MPG, SPD, LAT, LON, TRA FROM samples').fetchall() == [
+                (30.0, 88.0, None, None, None)]
+            assert con.execute('SELECT N FROM rollup_1s').fetchall() == [(1,)]
+        finally:
+            con.close()
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    test_track()
+    test_lost_fix_is_stored()
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+from time import time
+from context import Model
+from Model.Clock import GPSClock, monotonic
+from Model.GPSSource import GPSFix, MODE_NO_FIX, MODE_3D
+
+START = 1451861510.0
+
+
+class FakeGPS(object):
+    """
+    Just the fix attribute GPSClock reads, set by hand
+    """
+
+    def __init__(self):
+        self.fix = None
+
+    def report(self, utc, mode=MODE_3D):
+        """
+        Makes utc (epoch seconds, or None) the time of a report received just now
+        """
+        self.fix = GPSFix(mode, None if utc is None else GPSClock.format_utc(utc), 47.6, -122.3, 90.0, 0.0,
+                          monotonic())
+
+
+def close_to(milliseconds, seconds, tolerance=0.1):
+    return abs(milliseconds / 1000.0 - seconds) < tolerance
+
+
+def test_utc_round_trip():
+    assert GPSClock.parse_utc('2016-01-03T22:51:50.25Z') == START + 0.25
+    assert GPSClock.parse_utc('2016-01-03T22:51:50Z') == START
+    assert GPSClock.format_utc(START + 0.25) == '2016-01-03T22:51:50.250Z'
+
+
+def test_first_pin():
+    gps = FakeGPS()
+    gps.report(START)
+    clock = GPSClock(gps)
+    assert close_to(clock.now(), START)
+    assert clock.resyncs == 1
+
+
+def test_system_clock_without_utc():
+    gps = FakeGPS()
+    gps.report(None, MODE_NO_FIX)
+    clock = GPSClock(gps)
+    assert close_to(clock.now(), time())
+    assert clock.resyncs == 0
+
+    # A fix with a time takes over straight away, even though it's years behind the system clock
+    gps.report(START)
+    assert close_to(clock.now(), START)
+    assert clock.resyncs == 1
+
+
+def test_drift_resync():
+    gps = FakeGPS()
+    gps.report(START)
+    clock = GPSClock(gps, max_drift=1.0, check_interval=0)
+    clock.now()
+
+    # Within max_drift: left alone
+    gps.report(START + 0.5)
+    assert close_to(clock.now(), START)
+    assert clock.resyncs == 1
+
+    gps.report(START + 5)
+    assert close_to(clock.now(), START + 5)
+    assert clock.resyncs == 2
+
+    # Reports without a time are never checked against
+    gps.report(None, MODE_NO_FIX)
+    assert close_to(clock.now(), START + 5)
+    assert clock.resyncs == 2
+
+
+def test_backwards_resync_keeps_increasing():
+    gps = FakeGPS()
+    gps.report(START + 10)
+    clock = GPSClock(gps, max_drift=1.0, check_interval=0)
+    before = [clock.now() for _ in xrange(5)]
+
+    gps.report(START)
+    after = [clock.now() for _ in xrange(5)]
+    assert clock.resyncs == 2
+    timestamps = before + after
+    assert all(b > a for a, b in zip(timestamps, timestamps[1:]))
+    # Held a millisecond apart until GPS time catches up
+    assert after == range(before[-1] + 1, before[-1] + 6)
+
+if __name__ == '__main__':
+    test_utc_round_trip()
+    test_first_pin()
+    test_system_clock_without_utc()
+    test_drift_resync()
+    test_backwards_resync_keeps_increasing()
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+import random
+from context import Model
+from Model.DecodeFunctions import DECODERS, decode_obd_data, decode_frames
+
+try:
+    import numpy as np
+except ImportError:
+    # Bulk decoding is for the desktop; the Pi doesn't have NumPy
+    np = None
+
+PIDS = ['0104', '0105', '010C', '010D', '010E', '0110', '011F', '0142', '015E', '0101']
+
+
+def random_frames(rand, n):
+    pids = [rand.choice(PIDS) for _ in xrange(n)]
+    frames = [[rand.randint(0, 255) if i < DECODERS[pid].length else 0 for i in xrange(4)] for pid in pids]
+    return pids, frames
+
+
+def check(columns, pids, frames):
+    assert sorted(columns) == sorted(set(pids))
+    for pid, (rows, values) in columns.items():
+        assert list(rows) == [i for i, p in enumerate(pids) if p == pid]
+        for row, value in zip(rows, values):
+            expected = decode_obd_data(pid, bytearray(frames[row][:DECODERS[pid].length]))
+            assert abs(value - expected) < 1e-9, (pid, frames[row], value, expected)
+
+
+def test_matches_per_frame_decoding():
+    if np is None:
+        return
+    rand = random.Random(0)
+    pids, frames = random_frames(rand, 500)
+    matrix = np.array(frames, dtype=np.uint8)
+    # The same column of PIDs as text, as bytes, as the PID byte itself and as a mix of text and PID bytes
+    mixed = [pid if i % 2 else int(pid[2:], 16) for i, pid in enumerate(pids)]
+    for column in (pids, np.array(pids, dtype='S4'), [int(pid[2:], 16) for pid in pids], mixed):
+        check(decode_frames(matrix, column), pids, frames)
+
+
+def test_no_uint8_wraparound():
+    if np is None:
+        return
+    # A - 40 and A / 2 - 64 go negative for small A
+    columns = decode_frames(np.array([[0, 0, 0, 0], [10, 0, 0, 0]], dtype=np.uint8), ['0105', '010E'])
+    assert list(columns['0105'][1]) == [-40.0]
+    assert list(columns['010E'][1]) == [-59.0]
+
+if __name__ == '__main__':
+    test_matches_per_frame_decoding()
+    test_no_uint8_wraparound()
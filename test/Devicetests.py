@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+import random
+from PIL import Image, ImageDraw
+from context import Model
+from Model.oled.device import dummy, sh1106, ssd1306
+
+FRAMES = 20
+
+
+def baseline_pages(image, pages, reverse):
+    """
+    Packs image the way the drivers used to, a pixel at a time: for each page, each column's 8 pixels with the top one
+    in the low bit. The SSD1306 got its columns right to left.
+    """
+    width = image.size[0]
+    pix = list(image.getdata())
+    step = width * 8
+    frame = []
+    for y in xrange(0, pages * step, step):
+        buf = bytearray()
+        columns = xrange(width - 1, -1, -1) if reverse else xrange(width)
+        for x in columns:
+            byte = 0
+            for n in xrange(0, step, width):
+                byte |= (pix[x + y + n] & 0x01) << 8
+                byte >>= 1
+            buf.append(byte)
+        frame.append(buf)
+    return frame
+
+
+def random_image(rand, width=128, height=64):
+    image = Image.new('1', (width, height))
+    image.putdata([rand.choice((0, 255)) for _ in xrange(width * height)])
+    return image
+
+
+def test_pack_matches_baseline():
+    rand = random.Random(0)
+    for panel, reverse in ((sh1106, False), (ssd1306, True)):
+        device = dummy()
+        device.rotation = panel.rotation
+        for _ in xrange(FRAMES):
+            image = random_image(rand)
+            assert device.pack_frame(image) == baseline_pages(image, device.pages, reverse), panel.__name__
+
+
+def test_dirty_regions_match_full_frame():
+    rand = random.Random(1)
+    device = dummy()
+    image = Image.new('1', (device.width, device.height))
+    draw = ImageDraw.Draw(image)
+    full = 0
+    for _ in xrange(FRAMES):
+        x, y = rand.randint(0, device.width - 1), rand.randint(0, device.height - 1)
+        draw.rectangle((x, y, x + rand.randint(0, 20), y + rand.randint(0, 10)), fill=rand.choice((0, 255)))
+        device.display(image)
+        full += device.width * device.pages
+        assert device.ram == device.pack_frame(image)
+    # Only the changed runs went out
+    assert device.bytes_written < full
+
+    # An unchanged frame sends nothing, unless the display has been invalidated
+    written = device.bytes_written
+    device.display(image)
+    assert device.bytes_written == written
+    device.invalidate()
+    device.ram = [bytearray(device.width) for _ in xrange(device.pages)]
+    device.display(image)
+    assert device.bytes_written == written + device.width * device.pages
+    assert device.ram == device.pack_frame(image)
+
+if __name__ == '__main__':
+    test_pack_matches_baseline()
+    test_dirty_regions_match_full_frame()
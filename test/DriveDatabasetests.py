@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+import os
+import shutil
+import sqlite3
+import tempfile
+from context import Model
+from Model.DriveDatabase import DriveDatabase
+from Model.Sample import Sample
+
+NAN = float('nan')
+
+
+def make_legacy(path, started, rows):
+    """
+    Creates a D[started] table the way older versions did for each drive, with rows of
+    (TIMESTAMP, MPG, SPD, LAT, LON, TRA)
+    """
+    con = sqlite3.connect(path)
+    with con:
+        con.execute('CREATE TABLE D{0}(TIMESTAMP INT PRIMARY KEY, MPG REAL, '
+                    'SPD REAL, LAT REAL, LON REAL, TRA VARCHAR)'.format(started))
+        con.executemany('INSERT INTO D{0} VALUES(?, ?, ?, ?, ?, ?)'.format(started), rows)
+    con.close()
+
+
+def fetch(path, q):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute(q).fetchall()
+    finally:
+        con.close()
+
+
+def test_legacy_import():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive_data.db')
+        make_legacy(path, 1451861510, [(1451861510, 30.5, 88.0, 47.6, -122.3, '90.0'),
+                                       (1451861511, 31.0, 89.0, 47.6, -122.29, '91.5')])
+        db = DriveDatabase(path)
+        db.connect()
+        db.close()
+
+        assert fetch(path, 'SELECT DRIVE_ID, STARTED, LEGACY_TABLE FROM drives') == [(1, 1451861510000, 'D1451861510')]
+        rows = fetch(path, 'SELECT DRIVE_ID, TIMESTAMP, MPG, SPD, LAT, LON, TRA FROM samples ORDER BY TIMESTAMP')
+        # Seconds become milliseconds and the track becomes a number
+        assert rows == [(1, 1451861510000, 30.5, 88.0, 47.6, -122.3, 90.0),
+                        (1, 1451861511000, 31.0, 89.0, 47.6, -122.29, 91.5)]
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_legacy_import_once():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive_data.db')
+        make_legacy(path, 1451861510, [(1451861510, 30.5, 88.0, 47.6, -122.3, '90.0')])
+        for i in range(2):
+            db = DriveDatabase(path)
+            db.connect()
+            db.close()
+        assert fetch(path, 'SELECT COUNT(*) FROM drives') == [(1,)]
+
+        # A table left by an older version that ran in between is still picked up
+        make_legacy(path, 1451900000, [(1451900000, 25.0, 50.0, 47.7, -122.4, '180.0')])
+        db = DriveDatabase(path)
+        db.connect()
+        db.close()
+        assert fetch(path, 'SELECT LEGACY_TABLE FROM drives ORDER BY DRIVE_ID') == [('D1451861510',), ('D1451900000',)]
+        assert fetch(path, 'SELECT COUNT(*) FROM samples') == [(2,)]
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_nan_is_null():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive_data.db')
+        db = DriveDatabase(path)
+        db.new_drive(1451861510000)
+        # GPS fix lost
+        db.write_values(Sample(1451861510000, 30.5, 88.0, NAN, NAN, NAN, 0.2))
+        db.write_values(Sample(1451861510200, 31.0, 89.0, 47.6, -122.3, 90.0, 0.2))
+        db.close()
+
+        rows = fetch(path, 'SELECT TIMESTAMP, MPG, SPD, LAT, LON, TRA FROM samples ORDER BY TIMESTAMP')
+        assert rows == [(1451861510000, 30.5, 88.0, None, None, None),
+                        (1451861510200, 31.0, 89.0, 47.6, -122.3, 90.0)]
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_rollups():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive_data.db')
+        db = DriveDatabase(path, flush_rows=1000, flush_interval=3600)
+        # On a minute boundary
+        start = 1451861520000
+        drive = db.new_drive(start)
+        db.write_values(Sample(start, 30.0, 80.0, 47.6, -122.3, 90.0, 0.5, distance=0.01, fuel=0.001))
+        db.write_values(Sample(start + 500, 40.0, 90.0, 47.6, -122.3, 90.0, 0.5, distance=0.02, fuel=0.002))
+        db.flush()
+        assert fetch(path, 'SELECT BUCKET, N, MPG_SUM FROM rollup_1s') == [(start, 2, 70.0)]
+
+        # The first second's bucket is still open, so the next flush rewrites it rather than adding a second row
+        db.write_values(Sample(start + 900, 20.0, 70.0, 47.6, -122.3, 90.0, 0.4, distance=0.03, fuel=0.003))
+        db.write_values(Sample(start + 1200, 50.0, 100.0, 47.6, -122.3, 90.0, 0.3, distance=0.04, fuel=0.004))
+        db.close()
+
+        rows = fetch(path, 'SELECT DRIVE_ID, BUCKET, N, MPG_SUM, MPG_MIN, MPG_MAX, SPD_SUM, SPD_MIN, SPD_MAX '
+                           'FROM rollup_1s ORDER BY BUCKET')
+        assert rows == [(drive, start, 3, 90.0, 20.0, 40.0, 240.0, 70.0, 90.0),
+                        (drive, start + 1000, 1, 50.0, 50.0, 50.0, 100.0, 100.0, 100.0)]
+        for table in ('rollup_10s', 'rollup_60s'):
+            rows = fetch(path, 'SELECT BUCKET, N, MPG_SUM, MPG_MIN, MPG_MAX, DISTANCE, FUEL FROM {0}'.format(table))
+            assert len(rows) == 1
+            bucket, n, mpg_sum, mpg_min, mpg_max, distance, fuel = rows[0]
+            assert (bucket, n, mpg_sum, mpg_min, mpg_max) == (start, 4, 140.0, 20.0, 50.0)
+            assert abs(distance - 0.1) < 1e-9 and abs(fuel - 0.01) < 1e-9
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    test_legacy_import()
+    test_legacy_import_once()
+    test_nan_is_null()
+    test_rollups()
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+from context import Model
+from Model.Carputer import Carputer
+from Model.DriveDatabase import DriveDatabase
+from Model.DriveLog import DriveLogWriter, read_log, replay
+from Model.GPSSource import GPSFix, MODE_NO_FIX, MODE_3D
+from Model.OBDController import OBDController, NoOBDDataException
+from Model.OLEDController import OLEDController
+from Model.Simulators import ELM327Simulator
+from Model.oled.device import dummy
+
+# 88 km/h and a MAF of 3.79 g/s, echo and spaces off
+RESPONSE = '410D5810017B\r\r>'
+
+
+def record_drive(path, ticks=50):
+    """
+    Writes a drive of ticks requests, one every tenth of a second, with a fix before each
+    """
+    log = DriveLogWriter(path)
+    start = log._started
+    for i in xrange(ticks):
+        t = start + i * 0.1
+        log.gps(GPSFix(MODE_3D, '2016-01-03T22:51:50.{0:03d}Z'.format(i), 47.6, -122.3, 90.0, 24.4, t))
+        log.obd('010D101', RESPONSE, 0.04, t + 0.05)
+    log.close()
+
+
+def test_round_trip():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive.drv')
+        record_drive(path, ticks=2)
+        records = list(read_log(path))
+        assert [record[0] for record in records] == ['gps', 'obd', 'gps', 'obd']
+        kind, t, command, response, latency = records[3]
+        assert (t, command, response, latency) == (0.15, '010D101', RESPONSE, 0.04)
+        kind, t, fix = records[2]
+        assert fix.utc == '2016-01-03T22:51:50.001Z'
+        assert abs(fix.latitude - 47.6) < 1e-9
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_no_utc():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive.drv')
+        log = DriveLogWriter(path)
+        log.gps(GPSFix(MODE_NO_FIX, None, 0.0, 0.0, 0.0, 0.0, log._started))
+        log.close()
+        kind, t, fix = next(read_log(path))
+        assert fix.mode == MODE_NO_FIX and fix.utc is None
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_line_noise():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive.drv')
+        simulator = ELM327Simulator(latency=0.005, jitter=0.001)
+        obd = OBDController(None, connection=simulator)
+        assert obd.connect()
+        obd.recorder = DriveLogWriter(path)
+        try:
+            answer = simulator.answer
+            simulator.answer = lambda command: answer(command) + '\xff'
+            try:
+                obd.get_pids(['010D'])
+            except NoOBDDataException:
+                pass
+            simulator.answer = answer
+            # The reader thread is still going
+            assert '010D' in obd.get_pids(['010D'])
+        finally:
+            obd.disconnect()
+            obd.recorder.close()
+        responses = [record[3] for record in read_log(path) if record[0] == 'obd']
+        assert '\xff' in responses[0]
+    finally:
+        shutil.rmtree(workdir)
+
+
+def test_replay():
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'drive.drv')
+        record_drive(path)
+        db = DriveDatabase(os.path.join(workdir, 'replay.db'))
+        carputer = Carputer(None, None, OLEDController(device=dummy()), db)
+        assert replay(path, carputer) == 50
+        assert db.query('SELECT COUNT(*) FROM samples WHERE DRIVE_ID = {0}')[0] == 50
+        db.close()
+        # Each tick is 0.1 s apart, the first one from when its request was sent
+        assert abs(carputer.trip_time - (49 * 0.1 + 0.04)) < 1e-6
+        assert abs(carputer.total_distance / carputer.total_gal - 7.107 * 88 / 3.79) < 1e-6
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_no_utc()
+    test_line_noise()
+    test_replay()
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from math import isnan
+from context import Model
+from Model.NMEAGPSController import NMEAParser, NMEAGPSController, cfg_rate
+
+# Recorded from the NEO-6M: one epoch without a fix, then one with
+RECORDED = (b'$GPRMC,225150.00,V,,,,,,,030116,,,N*79\r\n'
+            b'$GPVTG,,,,,,,,,N*30\r\n'
+            b'$GPGGA,225150.00,,,,,0,00,99.99,,,,,,*67\r\n'
+            b'$GPRMC,225151.00,A,4736.00000,N,12218.00000,W,10.000,90.00,030116,,,A*7F\r\n'
+            b'$GPVTG,90.00,T,,M,10.000,N,18.520,K,A*0B\r\n'
+            b'$GPGGA,225151.00,4736.00000,N,12218.00000,W,1,07,1.20,30.5,M,-17.3,M,,*5A\r\n'
+            b'$GPGSA,A,3,01,02,03,04,,,,,,,,,2.1,1.2,1.7*30\r\n')
+
+
+def test_parses_recorded_stream():
+    sentences = NMEAParser().feed(RECORDED)
+    # GSA isn't one we parse
+    assert [kind for kind, fields in sentences] == ['RMC', 'VTG', 'GGA', 'RMC', 'VTG', 'GGA']
+    kind, rmc = sentences[3]
+    assert rmc['valid']
+    assert abs(rmc['latitude'] - 47.6) < 1e-9
+    assert abs(rmc['longitude'] + 122.3) < 1e-9
+    assert rmc['date'] == '2016-01-03'
+
+
+def test_chunk_boundaries_dont_matter():
+    parser = NMEAParser()
+    sentences = []
+    for i in range(len(RECORDED)):
+        sentences.extend(parser.feed(RECORDED[i:i + 1]))
+    # repr, because the no-fix sentences hold NaNs, which never compare equal
+    assert repr(sentences) == repr(NMEAParser().feed(RECORDED))
+
+
+def test_bad_checksum_is_skipped():
+    parser = NMEAParser()
+    corrupted = RECORDED.replace(b'4736.00000,N,12218', b'4736.00000,N,12219', 1)
+    assert len(parser.feed(corrupted)) == 5
+    assert parser.bad_checksums == 1
+
+
+def test_controller_publishes_fix():
+    controller = NMEAGPSController()
+    controller.feed(RECORDED[:RECORDED.index(b'$GPRMC,225151')])
+    assert not controller.has_fix
+    assert isnan(controller.fix.latitude)
+
+    controller.feed(RECORDED[RECORDED.index(b'$GPRMC,225151'):])
+    assert controller.has_fix
+    assert controller.wait_for_fix(0)
+    fix = controller.fix
+    assert fix.mode == 3
+    assert controller.time == '2016-01-03T22:51:51'
+    assert fix.track == 90.0
+    assert abs(fix.speed - 18.52 / 3.6) < 1e-9
+
+
+def sentence(body):
+    checksum = 0
+    for byte in bytearray(body):
+        checksum ^= byte
+    return b'$' + body + b'*' + '{0:02X}'.format(checksum).encode('ascii') + b'\r\n'
+
+
+def test_blank_course_keeps_track():
+    controller = NMEAGPSController()
+    controller.feed(RECORDED)
+    # Stopped: the receiver leaves RMC's course blank
+    controller.feed(sentence(b'GPRMC,225152.00,A,4736.00000,N,12218.00000,W,0.000,,030116,,,A'))
+    assert controller.time == '2016-01-03T22:51:52'
+    assert controller.fix.track == 90.0
+    assert controller.fix.speed == 0.0
+
+
+def test_cfg_rate_message():
+    # 200 ms measurement period, from the u-blox protocol spec
+    assert bytearray(cfg_rate(5)) == bytearray([0xB5, 0x62, 0x06, 0x08, 0x06, 0x00, 0xC8, 0x00, 0x01, 0x00, 0x01,
+                                                0x00, 0xDE, 0x6A])
+
+if __name__ == '__main__':
+    test_parses_recorded_stream()
+    test_chunk_boundaries_dont_matter()
+    test_bad_checksum_is_skipped()
+    test_controller_publishes_fix()
+    test_blank_course_keeps_track()
+    test_cfg_rate_message()
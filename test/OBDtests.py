@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+from context import Model
+from Model.OBDController import OBDController, NoOBDDataException
+
+# Recorded from the ELM327 asking for speed and MAF, echo and spaces on, then off
+SINGLE_FRAME = '010D101\r41 0D 58 10 01 7B \r\r>'
+SINGLE_FRAME_COMPACT = '410D5810017B\r\r>'
+
+# Six PIDs don't fit in one CAN frame: a byte count (0x00E = 14), then numbered frames with the last one padded out
+MULTI_FRAME = ('010D10052F04111\r'
+               '00E \r'
+               '0: 41 0D 58 10 01 7B \r'
+               '1: 05 5A 2F 80 04 33 11 \r'
+               '2: 20 00 00 00 00 00 00 \r\r>')
+MULTI_FRAME_COMPACT = '00E\r0:410D5810017B\r1:055A2F80043311\r2:20000000000000\r\r>'
+
+
+def raises_no_data(command, response):
+    try:
+        OBDController.split_response(command, response)
+    except NoOBDDataException:
+        return True
+    return False
+
+
+def test_single_frame():
+    for response in (SINGLE_FRAME, SINGLE_FRAME_COMPACT):
+        data = OBDController.split_response('010D10', response)
+        assert data == {'010D': bytearray([0x58]), '0110': bytearray([0x01, 0x7B])}
+
+
+def test_multi_frame():
+    for response in (MULTI_FRAME, MULTI_FRAME_COMPACT):
+        data = OBDController.split_response('010D10052F0411', response)
+        # The padding after the 14th byte isn't read as more PIDs
+        assert data == {'010D': bytearray([0x58]),
+                        '0110': bytearray([0x01, 0x7B]),
+                        '0105': bytearray([0x5A]),
+                        '012F': bytearray([0x80]),
+                        '0104': bytearray([0x33]),
+                        '0111': bytearray([0x20])}
+
+
+def test_searching():
+    data = OBDController.split_response('010D', '010D1\rSEARCHING...\r41 0D 58 \r\r>')
+    assert data == {'010D': bytearray([0x58])}
+
+
+def test_missing_pid():
+    # The car answered for speed but not MAF
+    assert raises_no_data('010D10', '41 0D 58 \r\r>')
+
+
+def test_no_data():
+    assert raises_no_data('010D10', '010D101\rNO DATA\r\r>')
+    assert raises_no_data('010D10', '?\r\r>')
+    assert raises_no_data('010D10', '')
+
+
+def test_cut_short():
+    assert raises_no_data('010D10', '41 0D 58 10 01 \r\r>')
+
+
+def test_trouble_codes():
+    assert OBDController.split_trouble_codes('03\r43 01 33 00 00 00 00 \r\r>') == ['P0133']
+    # CAN adapters count the codes first
+    assert OBDController.split_trouble_codes('43 02 01 33 C1 00 \r\r>') == ['P0133', 'U0100']
+    assert OBDController.split_trouble_codes('03\rNO DATA\r\r>') == []
+
+if __name__ == '__main__':
+    test_single_frame()
+    test_multi_frame()
+    test_searching()
+    test_missing_pid()
+    test_no_data()
+    test_cut_short()
+    test_trouble_codes()
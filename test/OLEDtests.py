@@ -3,6 +3,8 @@ from Queue import Queue
 from threading import Event
 from time import sleep
 from context import Model
+from Model.OLEDController import OLEDController
+from Model.oled.device import dummy
 
 
 def test_load_animation(oledcontroller):
@@ -21,6 +23,37 @@ def test_load_animation(oledcontroller):
     cancellation_token.set()
     t.join()
 
+
+def test_print_message(oledcontroller):
+    oledcontroller.print_message('No OBD Data\nReceived')
+    sleep(2)
+    oledcontroller.print_message('Lost Satellite Fix')
+    sleep(2)
+
+
+def test_message_fits():
+    # Runs without the display
+    oledcontroller = OLEDController(device=dummy())
+    for message in ('No OBD Data Received', 'Abnormal termination', 'No OBD Data\nReceived',
+                    'integer division or modulo by zero', 'Supercalifragilisticexpialidocious'):
+        lines = oledcontroller.wrap(message)
+        assert ' '.join(lines).replace(' ', '') == message.replace('\n', '').replace(' ', '')
+        assert all(oledcontroller.font.getsize(line)[0] <= oledcontroller.width for line in lines)
+    assert oledcontroller.wrap('No OBD Data Received') == ['No OBD Data', 'Received']
+
+
+def test_dashboard(oledcontroller):
+    # Ten seconds of slowly changing values, offered far faster than the dashboard's frame rate
+    frames = 0
+    for i in xrange(1000):
+        if oledcontroller.print_dashboard(30.0 + i / 100.0, 12.5 + (i % 50) / 10.0, 'NE' if i < 500 else 'E'):
+            frames += 1
+        sleep(.01)
+    assert frames <= 10 * oledcontroller.max_fps + 1
+
 if __name__ == '__main__':
-    oc = Model.OLEDController()
-    test_load_animation(oc)
\ No newline at end of file
+    test_message_fits()
+    oc = Model.OLEDController(max_fps=5.0)
+    test_load_animation(oc)
+    test_print_message(oc)
+    test_dashboard(oc)
\ No newline at end of file
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from context import Model
+from Model.OBDController import OBDFuture
+from Model.PIDScheduler import PIDScheduler
+
+FAST = ['010D', '0110']
+SLOW = ['0105', '012F']
+
+
+class FakeOBD(object):
+    """
+    Answers every request at once, with a byte of data per PID, and remembers what was asked for
+    """
+
+    MAX_PIDS = 6
+
+    def __init__(self):
+        self.batches = []
+        self.trouble_checks = 0
+
+    def request(self, pids):
+        self.batches.append(list(pids))
+        future = OBDFuture('01' + ''.join(pid[2:] for pid in pids), None)
+        future.set_result(dict((pid, bytearray([0])) for pid in pids))
+        return future
+
+    def check_trouble(self):
+        self.trouble_checks += 1
+        future = OBDFuture(PIDScheduler.TROUBLE_CODES, None)
+        future.set_result([])
+        return future
+
+
+def sent_at(times, batches, pid):
+    return [t for t, batch in zip(times, batches) if pid in batch]
+
+
+def test_schedule():
+    obd = FakeOBD()
+    scheduler = PIDScheduler(obd)
+    # A minute of requests ten times a second
+    times = [i / 10.0 for i in xrange(600)]
+    for now in times:
+        scheduler.request(now)
+
+    assert all(set(FAST) <= set(batch) for batch in obd.batches)
+    for pid in SLOW:
+        # 0.2 Hz from the first request on, once each time
+        assert sent_at(times, obd.batches, pid) == [i * 5.0 for i in xrange(12)], pid
+    assert obd.trouble_checks == 1
+    assert scheduler.latest[PIDScheduler.TROUBLE_CODES] == []
+
+    rates = scheduler.achieved_rates(60.0)
+    assert abs(rates['010D'] - 10.0) < 1e-9
+    assert abs(rates['0105'] - 0.2) < 1e-9
+    assert abs(rates[PIDScheduler.TROUBLE_CODES] - 1 / 60.0) < 1e-9
+
+
+def test_no_burst_after_stall():
+    obd = FakeOBD()
+    scheduler = PIDScheduler(obd)
+    # Nothing is asked for between 0.1 s and 20 s, e.g. while the adapter reconnects
+    times = [0.0, 0.1, 20.0, 20.1, 20.2, 24.9, 25.0, 25.1]
+    for now in times:
+        scheduler.request(now)
+    assert sent_at(times, obd.batches, '0105') == [0.0, 20.0, 25.0]
+
+
+def test_full_batch():
+    obd = FakeOBD()
+    scheduler = PIDScheduler(obd, {'010D': None, '0110': None, '0104': None, '0105': 1.0, '010C': 1.0,
+                                   '010F': 1.0, '0111': 0.5})
+    for i in xrange(40):
+        scheduler.request(i / 10.0)
+    assert all(len(batch) <= FakeOBD.MAX_PIDS for batch in obd.batches)
+    # Everything still gets its turn, the most overdue first
+    for pid in ('0105', '010C', '010F', '0111'):
+        assert any(pid in batch for batch in obd.batches[:2]), pid
+
+if __name__ == '__main__':
+    test_schedule()
+    test_no_burst_after_stall()
+    test_full_batch()
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from threading import Event, Thread
+from time import sleep
+from context import Model
+from Model.Pipeline import Stage
+
+
+def fill(policy, items, maxsize=2):
+    """
+    Puts items on a stage that hasn't started yet, then lets it work through them. Returns what the handler got and
+    the stage.
+    """
+    handled = []
+    stage = Stage('test', handled.append, maxsize, policy)
+    for item in items:
+        stage.put(item)
+    stage.start()
+    stage.stop()
+    return handled, stage
+
+
+def test_drop_oldest():
+    handled, stage = fill(Stage.DROP_OLDEST, range(5))
+    assert handled == [3, 4]
+    assert stage.dropped == 3
+
+
+def test_drop_newest():
+    handled, stage = fill(Stage.DROP_NEWEST, range(5))
+    assert handled == [0, 1]
+    assert stage.dropped == 3
+
+
+def test_block():
+    release = Event()
+    handled = []
+
+    def slow(item):
+        release.wait(5)
+        handled.append(item)
+
+    stage = Stage('test', slow, 1, Stage.BLOCK)
+    stage.start()
+    stage.put(0)
+    # Once the handler is stuck on the first item, the second fills the queue and the third has to wait for room
+    while not stage.queue.empty():
+        sleep(.01)
+    stage.put(1)
+    putter = Thread(target=stage.put, args=(2,))
+    putter.start()
+    putter.join(.2)
+    assert putter.is_alive()
+
+    release.set()
+    putter.join(5)
+    stage.stop()
+    assert handled == [0, 1, 2]
+    assert stage.dropped == 0
+
+
+def test_handler_errors_dont_stop_the_stage():
+    handled = []
+
+    def handler(item):
+        if item == 1:
+            raise ValueError('bad item')
+        handled.append(item)
+
+    stage = Stage('test', handler, 10)
+    stage.start()
+    for item in range(3):
+        stage.put(item)
+    stage.stop()
+    assert handled == [0, 2]
+
+if __name__ == '__main__':
+    test_drop_oldest()
+    test_drop_newest()
+    test_block()
+    test_handler_errors_dont_stop_the_stage()
@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+import random
+from context import Model
+from Model.RingBuffer import RingBuffer
+
+
+def brute_force(samples, capacity, now, seconds):
+    """
+    The same figures as RingBuffer.window, from a plain list of (time, mpg, speed, distance, fuel)
+    """
+    kept = [sample for sample in samples[-capacity:] if sample[0] > now - seconds]
+    n = len(kept)
+    mpg, speed, distance, fuel = [sum(sample[f] for sample in kept) for f in xrange(1, 5)]
+    return {'N': n,
+            'MPG': mpg / n if n else 0.0,
+            'SPD': speed / n if n else 0.0,
+            'DIST': distance,
+            'FUEL': fuel,
+            'AVG_MPG': distance / fuel if fuel else 0.0}
+
+
+def check(buf, samples, seconds):
+    expected = brute_force(samples, buf.capacity, samples[-1][0], seconds)
+    actual = buf.window(seconds)
+    assert actual['N'] == expected['N'], (seconds, actual, expected)
+    for key in expected:
+        assert abs(actual[key] - expected[key]) < 1e-6 * max(1.0, abs(expected[key])), (seconds, key)
+
+
+def test_matches_brute_force():
+    rand = random.Random(0)
+    # Small enough that the 5 minute window runs out of slots, so eviction by age and by capacity are both covered
+    buf = RingBuffer(windows=(10, 60, 300), capacity=500)
+    samples = []
+    t = 0.0
+    for i in xrange(3000):
+        # Ticks of varying length, with the occasional stall
+        t += rand.choice((rand.uniform(0.02, 0.3), rand.uniform(0.02, 0.3), rand.uniform(5, 15)))
+        sample = (t, rand.uniform(5, 60), rand.uniform(0, 120), rand.uniform(0, 0.01), rand.uniform(0, 0.001))
+        buf.add(*sample)
+        samples.append(sample)
+        if i % 37 == 0:
+            for seconds in buf.windows:
+                check(buf, samples, seconds)
+
+
+def test_capacity_covers_longest_window():
+    buf = RingBuffer(windows=(10, 60, 300), rate=25)
+    assert buf.capacity == 7500
+    # Five minutes at 25 samples a second all fit
+    for i in xrange(7500):
+        buf.add(i / 25.0, 30.0, 50.0, 0.01, 0.001)
+    assert buf.window(300)['N'] == 7500
+
+if __name__ == '__main__':
+    test_matches_brute_force()
+    test_capacity_covers_longest_window()